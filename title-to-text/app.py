@@ -1,11 +1,60 @@
 import os
+import json
+import asyncio
 import uvicorn
 import logging
-from fastapi import FastAPI, Form
-from utils import generate_subtitles_from_file
-from utils import extract_audio_from_video, identify_language_from_audio
+import numpy as np
+from pathlib import Path
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from jobs import JobManager, QueueFull
+from subtitles_generator import metrics
+from subtitles_generator.core import AssistedDecodingStats
+from subtitles_generator.decoding import DecodingStats
+from subtitles_generator.live import LiveTranscriber
+from subtitles_generator.pipeline import PipelineStats
+from subtitles_generator.transcript import Transcript, render, transcript_path
+from subtitles_generator.upload import (
+    MultipartUploadParser,
+    StreamingUpload,
+    UploadTooLarge,
+    load_upload,
+    prune_uploads,
+    upload_audio,
+)
+from utils import generate_subtitles_from_file, stream_subtitles_from_file
+from utils import detect_language_probabilities, identify_language_from_audio
+from utils import get_batch_scheduler, get_model_registry, get_transcript_cache, load_config
+from utils import get_decoding_options, get_model, preload_models
+
+cfg = load_config()
+
+# Subtitle jobs run on worker threads; the event loop only queues and polls them
+job_manager = JobManager(
+    max_workers=cfg.jobs.max_workers, max_pending=cfg.jobs.max_pending
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # models listed under serving.preload_models are loaded before the first request
+    preload_models(cfg)
+    prune_stored_uploads()
+    yield
+    job_manager.shutdown()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+
+# Point-in-time gauges are read from the live objects on every scrape
+metrics.LOADED_MODELS.set_function(lambda: len(get_model_registry(cfg).loaded()))
+metrics.JOBS_IN_FLIGHT.set_function(job_manager.active)
+metrics.JOBS_RUNNING.set_function(job_manager.running)
+metrics.BATCH_QUEUE_DEPTH.set_function(
+    lambda: get_batch_scheduler(cfg).pending() if cfg.batching.enabled else 0
+)
 
 # Define the folder where you want to save the video files
 VIDEO_FOLDER = "./video"
@@ -21,54 +70,394 @@ logging.basicConfig(
 )
 
 
-@app.post("/subtitle")
-async def read_root(
+def confine_output(output_file_path: str = None):
+    # Clients only name .srt files below outputs.directory; the transcript
+    # is written next to them, so anything else could overwrite files on
+    # this host
+    if not output_file_path:
+        return None
+    directory = Path(cfg.outputs.directory).resolve()
+    path = (directory / output_file_path).resolve()
+    if directory not in path.parents or path.suffix.lower() != ".srt":
+        raise ValueError(f"Output path must be an .srt file below {cfg.outputs.directory}, got {output_file_path}")
+    return str(path)
+
+
+def prune_stored_uploads(keep: str = None):
+    # retention limits from the uploads section of the config
+    prune_uploads(
+        cfg.uploads.directory,
+        max_bytes=int(cfg.uploads.max_total_mb * 1024**2),
+        max_age=cfg.uploads.ttl_hours * 3600,
+        keep=keep,
+    )
+
+
+def resolve_input(input_file_path: str = None, upload_id: str = None, output_file_path: str = None):
+    # Jobs read either a path on this host or a finished upload. Uploads
+    # come with their decoded samples and keep their subtitles next to them.
+    if upload_id is None:
+        return input_file_path, None, output_file_path
+    info = load_upload(cfg.uploads.directory, upload_id)
+    if not output_file_path:
+        output_file_path = os.path.join(os.path.dirname(info["media_path"]), "subtitles.srt")
+    return info["media_path"], upload_audio(info), output_file_path
+
+
+def resolve_language(input_file_path, language: str = None, model_size: str = None, precision: str = None):
+    # Identify language from the first window of audio; transcription then
+    # streams the file itself, so the full input is never held in memory.
+    # `input_file_path` may also be decoded samples.
+    detected_lang = identify_language_from_audio(
+        input_file_path, cfg.processing.sampling_rate, model_size, precision
+    )
+    logging.info(f"Detected language: {detected_lang}")
+
+    user_lang = language.lower() if language else None
+
+    if detected_lang == "Unknown" and user_lang:
+        lang = user_lang
+        logging.info(
+            f"Detected language is unknown. Hence, using user selected language : {lang}"
+        )
+    else:
+        lang = detected_lang
+
+    if user_lang and user_lang != detected_lang:
+        lang = user_lang
+        logging.info(f"User Selected Language : {user_lang}")
+
+    return lang
+
+
+def run_subtitle_job(
+    job, input_file_path, output_file_path, model_size, language, precision=None, upload_id=None
+):
+    job.check_cancelled()
+    input_file_path, audio, output_file_path = resolve_input(input_file_path, upload_id, output_file_path)
+    lang = resolve_language(input_file_path if audio is None else audio, language, model_size, precision)
+    # language detection takes a while; a cancel sent meanwhile stops the job here
+    job.report_progress(0, None)
+
+    # Generate subtitles
+    assistant_stats = AssistedDecodingStats() if cfg.assisted.enabled else None
+    decoding_stats = DecodingStats()
+    pipeline_stats = PipelineStats()
+    output_file_path = generate_subtitles_from_file(
+        model_size=model_size,
+        input_file=input_file_path,
+        output_file_path=output_file_path,
+        lang=lang,
+        progress_callback=job.report_progress,
+        audio=audio,
+        precision=precision,
+        assistant_stats=assistant_stats,
+        decoding_stats=decoding_stats,
+        pipeline_stats=pipeline_stats,
+    )
+    logging.info(f"Subtitles generated at {output_file_path}")
+    result = {
+        "output_file_path": str(output_file_path),
+        "transcript_path": str(transcript_path(output_file_path)),
+        "decoding": decoding_stats.as_dict(),
+        "pipeline": pipeline_stats.as_dict(),
+    }
+    if assistant_stats is not None:
+        result["assisted_decoding"] = assistant_stats.as_dict()
+    return result
+
+
+@app.post("/upload", status_code=201)
+async def upload_media(request: Request):
+    # Streams a multipart/form-data body with a "file" part to disk chunk by
+    # chunk while ffmpeg decodes it, so memory stays bounded by the chunk
+    # size and the client does not need to share a disk with the API. The
+    # returned upload_id can be passed to /language and /subtitle.
+    def new_upload(filename):
+        return StreamingUpload(
+            cfg.uploads.directory,
+            filename,
+            cfg.processing.sampling_rate,
+            max_bytes=int(cfg.uploads.max_size_mb * 1024**2),
+        )
+
+    try:
+        parser = MultipartUploadParser(request.headers.get("content-type", ""), new_upload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        async for chunk in request.stream():
+            # writes block on the decoder's pipe, so they run off the event loop
+            await run_in_threadpool(parser.write, chunk)
+        upload = parser.finish()
+        info = await run_in_threadpool(upload.finish)
+    except Exception as e:
+        if parser.upload is not None:
+            parser.upload.abort()
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=str(e))
+        logging.error(f"Upload failed: {e}")
+        raise HTTPException(status_code=400, detail=f"Upload failed: {e}")
+    logging.info(f"Stored upload {info['upload_id']} ({info['size']} bytes, {info['samples']} samples)")
+    await run_in_threadpool(prune_stored_uploads, info["upload_id"])
+    return {key: info[key] for key in ("upload_id", "filename", "size", "samples", "sampling_rate")}
+
+
+@app.post("/language")
+def detect_language(
+    input_file_path: str = Form(None),
+    model_size: str = Form(None),
+    upload_id: str = Form(None),
+    precision: str = Form(None),
+):
+    try:
+        input_file_path, audio, _ = resolve_input(input_file_path, upload_id)
+        probabilities = detect_language_probabilities(
+            input_file_path if audio is None else audio, cfg.processing.sampling_rate, model_size, precision
+        )
+        language, probability = max(probabilities.items(), key=lambda item: item[1])
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        return {"error": str(e)}
+
+    if probability < cfg.language_detection.min_probability:
+        language = "Unknown"
+    top = sorted(probabilities.items(), key=lambda item: item[1], reverse=True)[:5]
+    return {"language": language, "probabilities": dict(top)}
+
+
+@app.get("/cache")
+def get_cache_stats():
+    cache = get_transcript_cache(cfg)
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.post("/subtitle", status_code=202)
+def submit_subtitle_job(
     input_file_path: str = Form(None),
     output_file_path: str = Form(None),
     model_size: str = Form(),
     language: str = Form(None),
+    precision: str = Form(None),
+    upload_id: str = Form(None),
 ):
+    try:
+        output_file_path = confine_output(output_file_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        job = job_manager.submit(
+            run_subtitle_job,
+            input_file_path,
+            output_file_path,
+            model_size,
+            language,
+            precision,
+            upload_id,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    logging.info(f"Submitted job {job.id} for {upload_id or input_file_path}")
+    return job.to_dict()
+
 
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str):
+    return get_job_or_404(job_id).to_dict()
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Job {job_id} failed: {job.error}")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    return job.result
+
+
+SUBTITLE_MEDIA_TYPES = {"srt": "application/x-subrip", "vtt": "text/vtt", "json": "application/json"}
+
+
+@app.get("/jobs/{job_id}/subtitles")
+def get_job_subtitles(
+    job_id: str,
+    format: str = "srt",
+    max_chars: int = None,
+    max_duration: float = None,
+    max_gap: float = 0.0,
+    min_avg_logprob: float = None,
+):
+    # Renders the stored transcript of a finished job in another format or
+    # cue layout without running the model again
+    job = get_job_or_404(job_id)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+    if format not in SUBTITLE_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format {format} is not supported. Supported formats are {list(SUBTITLE_MEDIA_TYPES)}",
+        )
     try:
-        # Determine input file path
-        input_file = input_file_path
+        transcript = Transcript.load(job.result["transcript_path"])
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=410, detail=f"Transcript of job {job_id} is not available: {e}")
+    content = render(
+        transcript,
+        format,
+        max_chars=max_chars,
+        max_duration=max_duration,
+        max_gap=max_gap,
+        min_avg_logprob=min_avg_logprob,
+    )
+    return PlainTextResponse(content, media_type=SUBTITLE_MEDIA_TYPES[format])
 
-        # Extract audio from video
-        logging.info(f"Extracting audio from {input_file}")
-        input_file = extract_audio_from_video(input_file)
 
-        # Identify language from audio
-        detected_lang = identify_language_from_audio(str(input_file))
-        logging.info(f"Detected language: {detected_lang}")
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    get_job_or_404(job_id)
+    return job_manager.cancel(job_id).to_dict()
 
-        user_lang = language.lower() if language else None
 
-        if detected_lang == "Unknown" and user_lang:
-            lang = user_lang
-            logging.info(
-                f"Detected language is unknown. Hence, using user selected language : {lang}"
-            )
-        else:
-            lang = detected_lang
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        if user_lang and user_lang != detected_lang:
-            lang = user_lang
-            logging.info(f"User Selected Language : {user_lang}")
 
-        # Generate subtitles
-        output_file_path = generate_subtitles_from_file(
+@app.post("/subtitle/stream")
+def stream_subtitles(
+    input_file_path: str = Form(None),
+    output_file_path: str = Form(None),
+    model_size: str = Form(),
+    language: str = Form(None),
+    precision: str = Form(None),
+    upload_id: str = Form(None),
+):
+    # Server-sent events: one "cue" event per subtitle as soon as its batch
+    # is decoded, then a "done" event with the path of the written .srt
+    try:
+        output_file_path = confine_output(output_file_path)
+        input_file_path, audio, output_file_path = resolve_input(input_file_path, upload_id, output_file_path)
+        lang = resolve_language(input_file_path if audio is None else audio, language, model_size, precision)
+        output_file_path, cues = stream_subtitles_from_file(
             model_size=model_size,
-            input_file=input_file,
+            input_file=input_file_path,
             output_file_path=output_file_path,
             lang=lang,
+            audio=audio,
+            precision=precision,
+        )
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        return {"error": str(e)}
+
+    def events():
+        try:
+            for cue in cues:
+                yield sse_event("cue", cue._asdict())
+            logging.info(f"Subtitles generated at {output_file_path}")
+            yield sse_event(
+                "done",
+                {
+                    "output_file_path": str(output_file_path),
+                    "transcript_path": str(transcript_path(output_file_path)),
+                },
+            )
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            cues.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.websocket("/live")
+async def live_subtitles(websocket: WebSocket, model_size: str = None, language: str = None):
+    # Live subtitles: the client sends 16 kHz mono 16-bit little-endian PCM
+    # in binary messages and {"type": "end"} when it is done. The server
+    # answers with "partial" events that later decodes may revise, "cue"
+    # events that are final, and a "done" event with latency statistics.
+    await websocket.accept()
+    try:
+        model = await run_in_threadpool(get_model, cfg, model_size or cfg.live.model_size)
+        transcriber = LiveTranscriber(
+            model,
+            language.lower() if language else None,
+            cfg.processing.sampling_rate,
+            step_seconds=cfg.live.step_seconds,
+            window_seconds=cfg.live.window_seconds,
+            latency_seconds=cfg.live.latency_seconds,
+            decoding_options=get_decoding_options(cfg),
         )
-        logging.info(f"Subtitles generated at {output_file_path}")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=1011)
+        return
+
+    # audio keeps arriving while a window is decoded on a worker thread
+    arrived = asyncio.Event()
+    state = {"ended": False, "disconnected": False}
 
-        return {"output_file_path": output_file_path}
+    async def receive_audio():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    state["disconnected"] = True
+                    return
+                if message.get("bytes"):
+                    data = message["bytes"]
+                    # a trailing odd byte cannot be a sample
+                    pcm = np.frombuffer(data[: len(data) // 2 * 2], dtype="<i2")
+                    transcriber.append(pcm.astype(np.float32) / 32768)
+                elif message.get("text") and json.loads(message["text"]).get("type") == "end":
+                    return
+                arrived.set()
+        finally:
+            state["ended"] = True
+            arrived.set()
 
+    receiver = asyncio.create_task(receive_audio())
+    try:
+        while not state["ended"]:
+            await arrived.wait()
+            arrived.clear()
+            if transcriber.ready() and not state["ended"]:
+                for event in await run_in_threadpool(transcriber.step):
+                    await websocket.send_json(event)
+        await receiver
+        if state["disconnected"]:
+            logging.info(f"Live client disconnected: {transcriber.stats.as_dict()}")
+            return
+        for event in await run_in_threadpool(transcriber.finish):
+            await websocket.send_json(event)
+        stats = transcriber.stats.as_dict()
+        logging.info(f"Live stream finished: {stats}")
+        await websocket.send_json({"type": "done", "stats": stats})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logging.info(f"Live client disconnected: {transcriber.stats.as_dict()}")
     except Exception as e:
         logging.error(f"An error occurred: {e}")
-        return {"error": str(e)}
+        await websocket.send_json({"type": "error", "error": str(e)})
+        await websocket.close(code=1011)
+    finally:
+        receiver.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import wave
+import logging
+import pathlib
+import argparse
+import platform
+import itertools
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+from hydra import compose, initialize
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+
+def make_fixtures(directory: pathlib.Path, duration: int, seed: int = 0):
+    # Deterministic speech-like audio: harmonic voiced segments with a slow
+    # pitch and loudness contour, separated by short near-silent pauses.
+    # The same audio is also muxed into a small test-pattern video.
+    from subtitles_generator.audio import ffmpeg_executable
+
+    sampling_rate = 44100
+    rng = np.random.default_rng(seed)
+    t = np.arange(duration * sampling_rate) / sampling_rate
+    pitch = 120 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sampling_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    pauses = (np.floor(t / 3) % 4 == 3).astype(np.float32)
+    audio = 0.3 * voiced * envelope * (1 - pauses) + 0.002 * rng.standard_normal(t.shape)
+
+    # named apart from the video: extracting its audio writes <video stem>.wav
+    wav_path = directory / f"fixture_{duration}s_audio.wav"
+    with wave.open(str(wav_path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sampling_rate)
+        wf.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+    video_path = directory / f"fixture_{duration}s.mp4"
+    subprocess.run(
+        [
+            ffmpeg_executable(), "-nostdin", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", f"testsrc=duration={duration}:size=320x240:rate=15",
+            "-i", str(wav_path),
+            "-c:v", "mpeg4", "-c:a", "aac", "-shortest",
+            str(video_path),
+        ],
+        check=True,
+    )
+    return wav_path, video_path
+
+
+def current_rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def measure(fn, *args, **kwargs):
+    # wall time and peak resident memory above the starting point
+    baseline = peak = current_rss()
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(0.01):
+            peak = max(peak, current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    peak = max(peak, current_rss())
+    return result, elapsed, (peak - baseline) / 1024**2
+
+
+class Benchmark:
+    def __init__(self, duration: float):
+        self.duration = duration
+        self.results = []
+
+    def run(self, stage: str, fn, *args, **params):
+        call_kwargs = params.pop("call_kwargs", {})
+        try:
+            result, elapsed, peak_mb = measure(fn, *args, **call_kwargs)
+        except ImportError as e:
+            logging.info(f"Skipping {stage}: {e}")
+            self.results.append({"stage": stage, **params, "skipped": str(e)})
+            return None
+        self.results.append(
+            {
+                "stage": stage,
+                **params,
+                "wall_s": elapsed,
+                "real_time_factor": elapsed / self.duration,
+                "peak_rss_mb": peak_mb,
+            }
+        )
+        logging.info(f"{stage} {params}: {elapsed:.3f}s (RTF {elapsed / self.duration:.3f}), +{peak_mb:.0f} MB")
+        return result
+
+
+def legacy_extract_audio_from_video(video_path):
+    from utils import extract_audio_from_video
+
+    return extract_audio_from_video(video_path)
+
+
+def legacy_extract_audio(video_path):
+    from subtitles_generator.utils import extract_audio
+
+    return extract_audio(pathlib.Path(video_path))
+
+
+def legacy_resample(wav_path, sampling_rate):
+    import librosa
+
+    return librosa.load(wav_path, sr=sampling_rate)[0]
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(
+        (key, result[key])
+        for key in ("stage", "model_size", "precision", "chunk_size", "batch_size", "optimize")
+        if key in result
+    )
+
+
+def compare(results: list, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"] if "wall_s" in r}
+    print(f"\n{'stage':<40} {'baseline s':>11} {'current s':>10} {'ratio':>7}")
+    for result in results:
+        previous = baseline.get(result_key(result))
+        if previous is None or "wall_s" not in result:
+            continue
+        name = " ".join(str(value) for _, value in result_key(result))
+        ratio = result["wall_s"] / previous["wall_s"] if previous["wall_s"] else float("nan")
+        print(f"{name:<40} {previous['wall_s']:>11.3f} {result['wall_s']:>10.3f} {ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each subtitle pipeline stage on synthetic fixtures")
+    parser.add_argument("--duration", type=int, default=60, help="fixture length in seconds")
+    parser.add_argument("--model_sizes", nargs="+", default=["tiny", "base"])
+    parser.add_argument("--chunk_sizes", nargs="+", type=int, default=[2, 5])
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=[4, 16])
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--lang", default="english")
+    parser.add_argument("--skip_legacy", action="store_true", help="skip moviepy/librosa stages")
+    parser.add_argument("--draft_model_size", help="also time assisted decoding with this draft model")
+    parser.add_argument(
+        "--optimize", action="store_true", help="also time each model in optimized (compiled) mode"
+    )
+    parser.add_argument("--output_file", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    with initialize(version_base=None, config_path="subtitles_generator/conf"):
+        cfg = compose(config_name="config")
+
+    from subtitles_generator.audio import decode_audio
+    from subtitles_generator.core import AssistedDecodingStats, Model
+    from subtitles_generator.utils import create_srt
+
+    sampling_rate = cfg.processing.sampling_rate
+    bench = Benchmark(args.duration)
+
+    draft = None
+    if args.draft_model_size:
+        draft = Model(cfg.model_names[args.draft_model_size], device="cpu", precision=args.precision)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        wav_path, video_path = make_fixtures(tmp, args.duration)
+
+        # container decode and resampling
+        if not args.skip_legacy:
+            bench.run("extract_audio_from_video", legacy_extract_audio_from_video, video_path)
+            bench.run("extract_audio", legacy_extract_audio, video_path)
+            bench.run("librosa_resample", legacy_resample, str(wav_path), sampling_rate)
+        bench.run("decode_audio_video", decode_audio, video_path, sampling_rate)
+        audio = bench.run("decode_audio_wav", decode_audio, wav_path, sampling_rate)
+
+        modes = [False, True] if args.optimize else [False]
+        for model_size, optimize in itertools.product(args.model_sizes, modes):
+            # optimized rows carry an `optimize` key, eager rows stay
+            # comparable with baselines recorded before the option existed
+            mode = {"optimize": True} if optimize else {}
+            model = bench.run(
+                "model_load",
+                Model,
+                cfg.model_names[model_size],
+                model_size=model_size,
+                precision=args.precision,
+                **mode,
+                call_kwargs={"device": "cpu", "precision": args.precision, "optimize": optimize},
+            )
+            if optimize:
+                bench.results[-1]["optimizations"] = model.optimizations
+            assisted = draft is not None
+            if assisted:
+                try:
+                    model.check_assistant(draft)
+                except ValueError as e:
+                    logging.info(f"Skipping assisted decoding: {e}")
+                    assisted = False
+            for chunk_size in args.chunk_sizes:
+                params = {"model_size": model_size, "precision": args.precision, "chunk_size": chunk_size, **mode}
+                features = bench.run(
+                    "get_features", model.get_features, audio, chunk_size, sampling_rate, **params
+                )
+                if optimize:
+                    # compilation for the measured batch sizes, kept out of the timed stages
+                    bench.run(
+                        "warmup", model.warmup, args.batch_sizes, chunk_size, sampling_rate, **params
+                    )
+                for batch_size in args.batch_sizes:
+                    # a single generate call on one batch of chunks
+                    bench.run(
+                        "generate",
+                        model.generate_batch,
+                        features[:batch_size],
+                        model.get_prompt_ids(args.lang),
+                        batch_size=batch_size,
+                        **params,
+                    )
+                    texts = bench.run(
+                        "transcribe",
+                        model.transcribe,
+                        audio,
+                        chunk_size,
+                        sampling_rate,
+                        args.lang,
+                        batch_size,
+                        batch_size=batch_size,
+                        **params,
+                    )
+                    if draft is not None and assisted:
+                        stats = AssistedDecodingStats()
+                        bench.run(
+                            "transcribe_assisted",
+                            model.transcribe,
+                            audio,
+                            chunk_size,
+                            sampling_rate,
+                            args.lang,
+                            batch_size,
+                            batch_size=batch_size,
+                            draft_model_size=args.draft_model_size,
+                            **params,
+                            call_kwargs={"assistant": draft, "assistant_stats": stats},
+                        )
+                        bench.results[-1]["assisted_decoding"] = stats.as_dict()
+                bench.run(
+                    "create_srt", create_srt, tmp / "out.srt", texts, chunk_size, **params
+                )
+
+    import torch
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": torch.get_num_threads(),
+            "duration_s": args.duration,
+        },
+        "results": bench.results,
+    }
+    with open(args.output_file, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Results saved to {args.output_file}")
+
+    if args.baseline:
+        compare(bench.results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from subtitles_generator.metrics import JOBS_FINISHED
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def check_cancelled(self):
+        # raising here is what stops a cancelled job and hands its worker
+        # back to the pool
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def report_progress(self, done: int, total: int):
+        # called by the running task between batches
+        self.done = done
+        self.total = total
+        self.check_cancelled()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    # Runs subtitle jobs on a bounded pool of worker threads so request
+    # handlers only submit work and return a job id.
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 32, max_finished: int = 100):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="subtitle-job"
+        )
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Job:
+        # `fn` receives the job as first argument to report progress
+        job = Job()
+        with self._lock:
+            if self._active() >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs are already pending")
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job:
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job._cancel_event.set()
+        # a job that has not started yet never takes a worker
+        if job.future is not None and job.future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    # read by the /metrics gauges while submit() adds and prunes jobs
+    def active(self) -> int:
+        with self._lock:
+            return self._active()
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(job.status == "running" for job in self._jobs.values())
+
+    def shutdown(self):
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: Job, fn, args, kwargs):
+        if job._cancel_event.is_set():
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        try:
+            result = fn(job, *args, **kwargs)
+            # a cancel that arrived after the last progress report still counts
+            job.check_cancelled()
+            job.result = result
+            self._finish(job, "completed")
+        except JobCancelled:
+            logging.info(f"Job {job.id} cancelled")
+            self._finish(job, "cancelled")
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            self._finish(job, "failed")
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        JOBS_FINISHED.inc(status=status)
+
+    def _active(self) -> int:
+        # called with the lock held
+        return sum(not job.finished for job in self._jobs.values())
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,96 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import urllib.parse
+
+import numpy as np
+import websockets
+
+from subtitles_generator.audio import decode_audio
+from subtitles_generator.transcript import render_srt
+from subtitles_generator.utils import Cue
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+SAMPLING_RATE = 16000
+
+
+async def send_audio(websocket, samples: np.ndarray, frame_ms: int, speed: float):
+    # 16-bit PCM frames paced like a microphone; speed 0 sends as fast as possible
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    frame_samples = SAMPLING_RATE * frame_ms // 1000
+    start = time.perf_counter()
+    for i in range(0, pcm.shape[0], frame_samples):
+        if speed > 0:
+            due = start + i / SAMPLING_RATE / speed
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await websocket.send(pcm[i : i + frame_samples].tobytes())
+    await websocket.send(json.dumps({"type": "end"}))
+
+
+async def replay(url: str, samples: np.ndarray, frame_ms: int, speed: float) -> tuple:
+    # returns the cues and the server's statistics
+    cues, stats = [], None
+    async with websockets.connect(url, max_size=None) as websocket:
+        sender = asyncio.create_task(send_audio(websocket, samples, frame_ms, speed))
+        try:
+            async for message in websocket:
+                event = json.loads(message)
+                if event["type"] == "partial":
+                    # partial hypotheses overwrite each other on one line
+                    sys.stderr.write(f"\r\033[K… {event['text'][-100:]}")
+                elif event["type"] == "cue":
+                    cues.append(Cue(event["index"], event["start"], event["end"], event["text"]))
+                    sys.stderr.write("\r\033[K")
+                    print(
+                        f"[{event['start']:7.2f} -> {event['end']:7.2f}] {event['text']}"
+                        f"  (latency {event['latency_s']:.2f}s)"
+                    )
+                elif event["type"] == "done":
+                    stats = event["stats"]
+                    break
+                elif event["type"] == "error":
+                    raise RuntimeError(event["error"])
+            await sender
+        finally:
+            sender.cancel()
+    sys.stderr.write("\r\033[K")
+    return cues, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream an audio file to the /live endpoint at real-time speed and print the cues"
+    )
+    parser.add_argument("--input_file", required=True, help="WAV or any other file ffmpeg can decode")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/live")
+    parser.add_argument("--model_size", help="defaults to live.model_size of the server")
+    parser.add_argument("--lang", help="language of speech; detected per window when omitted")
+    parser.add_argument("--frame_ms", type=int, default=100, help="audio per WebSocket message")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 sends without pacing")
+    parser.add_argument("--output_file", help="write the cues to this .srt file")
+    args = parser.parse_args()
+
+    params = {key: value for key, value in (("model_size", args.model_size), ("language", args.lang)) if value}
+    url = f"{args.url}?{urllib.parse.urlencode(params)}" if params else args.url
+    samples = decode_audio(args.input_file, SAMPLING_RATE)
+    logging.info(f"Streaming {len(samples) / SAMPLING_RATE:.1f}s of audio to {url}")
+
+    cues, stats = asyncio.run(replay(url, samples, args.frame_ms, args.speed))
+    logging.info(f"Live stream finished: {stats}")
+    if args.output_file:
+        with open(args.output_file, "w", encoding="utf-8") as f:
+            f.write(render_srt(cues))
+        logging.info(f"Subtitles written to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
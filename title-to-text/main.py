@@ -0,0 +1,268 @@
+import csv
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import generate_subtitles_from_file, identify_language_from_audio, load_config
+from subtitles_generator.audio import decode_audio, probe_duration
+from subtitles_generator.decoding import DecodingStats
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+
+def read_manifest(manifest_path: Path) -> list:
+    # CSV with a header row or JSON lines; each entry needs "input" and may
+    # set "output" and "lang". Relative paths are taken from the working directory.
+    with open(manifest_path, newline="", encoding="utf-8") as f:
+        if manifest_path.suffix.lower() in (".jsonl", ".ndjson"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    entries = []
+    for line_number, row in enumerate(rows, start=1):
+        if not row.get("input"):
+            raise ValueError(f"Manifest entry {line_number} in {manifest_path} has no input")
+        entries.append(
+            {"input": row["input"], "output": row.get("output") or None, "lang": row.get("lang") or None}
+        )
+    return entries
+
+
+def scan_directory(input_dir: Path, extensions) -> list:
+    return [
+        {"input": str(path), "output": None, "lang": None}
+        for path in sorted(input_dir.rglob("*"))
+        if path.is_file() and path.suffix.lower() in extensions
+    ]
+
+
+def default_output_path(input_path: Path, input_dir: Path = None, output_dir: Path = None) -> Path:
+    # next to the input unless an output directory is given, where the
+    # layout below `input_dir` is kept
+    if output_dir is None:
+        return input_path.with_suffix(".srt")
+    relative = input_path.relative_to(input_dir) if input_dir else Path(input_path.name)
+    return (output_dir / relative).with_suffix(".srt")
+
+
+def assign_output_paths(entries: list, input_dir: Path = None, output_dir: Path = None):
+    # Fills in the default output of entries without one. Inputs that would
+    # share an .srt (the same stem in different manifest directories, or
+    # a.mp4 next to a.wav) get a numbered name instead; the numbering
+    # follows the entry order, so a resumed run picks the same names.
+    taken = {str(Path(entry["output"])) for entry in entries if entry["output"] is not None}
+    for entry in entries:
+        if entry["output"] is not None:
+            continue
+        path = default_output_path(Path(entry["input"]), input_dir, output_dir)
+        candidate, number = path, 1
+        while str(candidate) in taken:
+            candidate = path.with_name(f"{path.stem}-{number}{path.suffix}")
+            number += 1
+        taken.add(str(candidate))
+        entry["output"] = str(candidate)
+
+
+class ProgressState:
+    # Append-only JSON lines file with one record per finished or failed
+    # input. A record is only written after its .srt is complete, so an
+    # interrupted run redoes at most the files that were in progress.
+    # Without a path progress is only kept in memory.
+
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.records = {}
+        self._file = None
+        if path is None:
+            return
+        if path.is_file():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a killed run may be cut short
+                        continue
+                    self.records[record["input"]] = record
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, input_path: str, output_path: str) -> bool:
+        record = self.records.get(input_path)
+        return (
+            record is not None
+            and record["status"] == "done"
+            and record["output"] == output_path
+            and Path(output_path).is_file()
+        )
+
+    def record(self, input_path: str, output_path: str, status: str, **details):
+        record = {"input": input_path, "output": output_path, "status": status, **details}
+        self.records[input_path] = record
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def transcribe_all(
+    entries: list,
+    model_size: str,
+    lang: str,
+    state: ProgressState,
+    prefetch: int = 2,
+    precision: str = None,
+    prefetch_mb: float = 512,
+) -> dict:
+    # Transcribes the entries one after another with the models kept in the
+    # registry. Audio of the next `prefetch` files is decoded in the
+    # background while the current file is transcribed, as long as the
+    # decoded samples held (current file included) stay within
+    # `prefetch_mb`. Files that do not fit on their own, or whose duration
+    # cannot be probed, are streamed from disk while they are transcribed.
+    cfg = load_config()
+    sampling_rate = cfg.processing.sampling_rate
+    budget = prefetch_mb * 1024**2
+    summary = {"done": 0, "skipped": 0, "failed": 0}
+
+    pending = []
+    for entry in entries:
+        if state.is_done(entry["input"], entry["output"]):
+            summary["skipped"] += 1
+        else:
+            pending.append(entry)
+    logging.info(f"{len(pending)} files to transcribe, {summary['skipped']} already done")
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") as decoder:
+        # (entry, decoded bytes, future); no future for streamed entries
+        queue = deque()
+        upcoming = deque(pending)
+        current = 0
+
+        def fill(limit):
+            while upcoming and len(queue) < limit:
+                entry = upcoming[0]
+                if "duration" not in entry:
+                    entry["duration"] = probe_duration(entry["input"])
+                # decoded as float32 samples
+                size = None if entry["duration"] is None else int(entry["duration"] * sampling_rate) * 4
+                if size is None or size > budget:
+                    queue.append((entry, 0, None))
+                elif current + sum(queued for _, queued, _ in queue) + size <= budget:
+                    queue.append((entry, size, decoder.submit(decode_audio, entry["input"], sampling_rate)))
+                else:
+                    # wait until the current file is done
+                    return
+                upcoming.popleft()
+
+        while True:
+            current = 0
+            fill(1)
+            if not queue:
+                break
+            entry, current, audio = queue.popleft()
+            fill(prefetch)
+            input_path, output_path = entry["input"], entry["output"]
+            start = time.perf_counter()
+            try:
+                if audio is not None:
+                    audio = audio.result()
+                file_lang = entry["lang"] or lang or identify_language_from_audio(
+                    input_path if audio is None else audio, sampling_rate, precision=precision
+                )
+                decoding_stats = DecodingStats()
+                generate_subtitles_from_file(
+                    model_size=model_size,
+                    input_file=input_path,
+                    output_file_path=output_path,
+                    lang=file_lang,
+                    audio=audio,
+                    precision=precision,
+                    decoding_stats=decoding_stats,
+                )
+            except Exception as e:
+                logging.error(f"Failed to transcribe {input_path}: {e}")
+                state.record(input_path, output_path, "failed", error=str(e))
+                summary["failed"] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            state.record(
+                input_path,
+                output_path,
+                "done",
+                lang=file_lang,
+                duration_s=round(len(audio) / sampling_rate if audio is not None else entry["duration"] or 0, 3),
+                wall_s=round(elapsed, 3),
+                decoding=decoding_stats.as_dict(),
+            )
+            summary["done"] += 1
+            logging.info(f"Subtitles generated at {output_path} in {elapsed:.1f}s")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate .srt subtitles for one file or a batch of files")
+    parser.add_argument("--model_size", default="base", help="size of model to use (large, medium, base, ...)")
+    parser.add_argument("--lang", help="language of speech; detected per file when omitted")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--input_file", help="path to an audio or a video file")
+    inputs.add_argument("--input_dir", help="transcribe every supported media file below this directory")
+    inputs.add_argument("--manifest", help="CSV or JSONL file with input, output and lang per file")
+    parser.add_argument("--output_file", help="path to the .srt file for --input_file")
+    parser.add_argument("--output_dir", help="directory for .srt files; defaults to next to each input")
+    parser.add_argument("--state_file", help="progress file used to resume an interrupted batch")
+    parser.add_argument("--prefetch", type=int, default=2, help="files decoded ahead of the one being transcribed")
+    parser.add_argument(
+        "--prefetch_mb", type=float, default=512, help="decoded audio held in memory; larger files are streamed"
+    )
+    parser.add_argument("--precision", help="fp32, bf16 or int8; defaults to registry.precision")
+    args = parser.parse_args()
+
+    cfg = load_config()
+    output_dir = Path(args.output_dir) if args.output_dir else None
+    if args.input_file:
+        input_path = Path(args.input_file)
+        entries = [{"input": str(input_path), "output": args.output_file, "lang": None}]
+        # a single file only keeps progress when asked to
+        base = None
+        input_dir = None
+    elif args.input_dir:
+        input_dir = Path(args.input_dir)
+        extensions = set(cfg.supported_media_formats.video) | set(cfg.supported_media_formats.audio)
+        entries = scan_directory(input_dir, extensions)
+        base = output_dir or input_dir
+    else:
+        manifest_path = Path(args.manifest)
+        entries = read_manifest(manifest_path)
+        base = manifest_path.parent
+        input_dir = None
+    assign_output_paths(entries, input_dir, output_dir)
+
+    if args.state_file:
+        state = ProgressState(Path(args.state_file))
+    else:
+        state = ProgressState(base / ".subtitles_progress.jsonl" if base else None)
+    try:
+        summary = transcribe_all(
+            entries, args.model_size, args.lang, state, args.prefetch, args.precision, args.prefetch_mb
+        )
+    finally:
+        state.close()
+    logging.info(f"Batch finished: {summary}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,129 @@
+import json
+import time
+import logging
+import argparse
+import resource
+import multiprocessing
+
+from hydra import compose, initialize
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] {%(pathname)s:%(lineno)d} %(levelname)s - %(message)s",
+    datefmt="%H:%M:%S",
+)
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    reference, hypothesis = reference.split(), hypothesis.split()
+    if not reference:
+        return float(bool(hypothesis))
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, start=1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, start=1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (ref_word != hyp_word),
+                )
+            )
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def run_profile(model_name, precision, audio, lang, chunk_size, batch_size, sampling_rate, results):
+    # runs in its own process so peak RSS belongs to this profile only
+    from subtitles_generator.core import Model
+
+    start = time.perf_counter()
+    model = Model(model_name, device="cpu", precision=precision)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    texts = model.transcribe(
+        audio, chunk_size=chunk_size, sampling_rate=sampling_rate, lang=lang, batch_size=batch_size
+    )
+    elapsed = time.perf_counter() - start
+
+    results.put(
+        {
+            "precision": precision,
+            "dtype": str(model.dtype),
+            "load_time_s": load_time,
+            "transcribe_time_s": elapsed,
+            "real_time_factor": elapsed / (len(audio) / sampling_rate),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "weights_mb": model.memory_footprint() / 1024**2,
+            "texts": texts,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare speed, memory and output drift of precision profiles against fp32"
+    )
+    parser.add_argument("--input_file", required=True)
+    parser.add_argument("--model_size", default="base")
+    parser.add_argument("--lang", default="english")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--output_file", default="precision_report.json")
+    args = parser.parse_args()
+
+    with initialize(version_base=None, config_path="subtitles_generator/conf"):
+        cfg = compose(config_name="config")
+
+    from subtitles_generator.audio import decode_audio
+
+    sampling_rate = cfg.processing.sampling_rate
+    audio = decode_audio(args.input_file, sampling_rate)
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+
+    context = multiprocessing.get_context("spawn")
+    reports = []
+    for precision in precisions:
+        logging.info(f"Running {precision} ...")
+        results = context.Queue()
+        process = context.Process(
+            target=run_profile,
+            args=(
+                cfg.model_names[args.model_size],
+                precision,
+                audio,
+                args.lang,
+                cfg.processing.chunk_size,
+                cfg.processing.batch_size,
+                sampling_rate,
+                results,
+            ),
+        )
+        process.start()
+        reports.append(results.get())
+        process.join()
+
+    # drift is measured against the fp32 transcription of the same audio
+    reference = reports[0]["texts"]
+    for report in reports:
+        texts = report.pop("texts")
+        report["chunks_changed"] = sum(a != b for a, b in zip(reference, texts)) / max(1, len(texts))
+        report["word_error_rate_vs_fp32"] = word_error_rate(" ".join(reference), " ".join(texts))
+
+    print(f"{'precision':>10} {'RTF':>8} {'peak RSS MB':>12} {'weights MB':>11} {'WER vs fp32':>12}")
+    for report in reports:
+        print(
+            f"{report['precision']:>10} {report['real_time_factor']:>8.3f} {report['peak_rss_mb']:>12.0f} "
+            f"{report['weights_mb']:>11.0f} {report['word_error_rate_vs_fp32']:>12.3f}"
+        )
+
+    with open(args.output_file, "w") as f:
+        json.dump(
+            {"input_file": args.input_file, "model_size": args.model_size, "profiles": reports}, f, indent=2
+        )
+    logging.info(f"Report saved to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import os
-import av
 import re
-import cv2
+import time
 import uuid
 import logging
 import requests
@@ -9,11 +8,124 @@ import subprocess
 import streamlit as st
 from pytube import YouTube
 from fastapi import HTTPException
-from streamlit_webrtc import webrtc_streamer, WebRtcMode, VideoProcessorBase, RTCConfiguration
-from utils import download_video, extract_audio_from_video, identify_language_from_audio, record_video_and_audio
+from streamlit_webrtc import (
+    AudioProcessorBase,
+    RTCConfiguration,
+    VideoProcessorBase,
+    WebRtcMode,
+    webrtc_streamer,
+)
+from subtitles_generator.recorder import StreamingRecorder
+from utils import download_video, load_config
+
+cfg = load_config()
+
+# Define the backend URL; the API may run on another host
+BACKEND_URL = os.environ.get("SUBTITLES_BACKEND_URL", "http://127.0.0.1:8000")
+POLL_INTERVAL = 1.0
+UPLOAD_CHUNK_SIZE = 1024**2
+
+
+def multipart_body(file, filename, boundary):
+    # multipart/form-data with a single "file" part, produced chunk by chunk
+    # so requests streams the upload instead of building it in memory
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename.replace(chr(34), "")}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b""):
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def upload_media(file, filename):
+    # Streams a file object or local path to the backend, returns its upload id
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            return upload_media(f, filename)
+    boundary = uuid.uuid4().hex
+    response = requests.post(
+        f"{BACKEND_URL}/upload",
+        data=multipart_body(file, filename, boundary),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+    if response.status_code != 201:
+        logging.error(f"Upload failed: {response.text}")
+        return None
+    return response.json()["upload_id"]
 
-# Define the backend URL
-BACKEND_URL = "http://127.0.0.1:8000/subtitle"
+
+def detect_language(upload_id, model_size):
+    response = requests.post(
+        f"{BACKEND_URL}/language",
+        data={"upload_id": upload_id, "model_size": model_size},
+    )
+    result = response.json()
+    if response.status_code != 200 or "error" in result:
+        logging.error(f"Language detection failed: {result}")
+        return "Unknown"
+    return result["language"]
+
+
+def run_subtitle_job(data):
+    # Submit a job to the backend and poll it until it finishes
+    response = requests.post(f"{BACKEND_URL}/subtitle", data=data)
+    if response.status_code != 202:
+        logging.error(f"Job submission failed with response status: {response.status_code}")
+        return None
+    job_id = response.json()["job_id"]
+    logging.info(f"Submitted subtitle job {job_id}")
+
+    progress_bar = st.progress(0.0, text="Waiting for a free worker...")
+    while True:
+        status = requests.get(f"{BACKEND_URL}/jobs/{job_id}").json()
+        done, total = status["progress"]["done"], status["progress"]["total"]
+        if total:
+            progress_bar.progress(done / total, text=f"Transcribed {done}/{total} chunks")
+        if status["status"] in ("completed", "failed", "cancelled"):
+            break
+        time.sleep(POLL_INTERVAL)
+    progress_bar.empty()
+
+    if status["status"] != "completed":
+        logging.error(f"Job {job_id} {status['status']}: {status['error']}")
+        return None
+    # the subtitles are rendered by the backend, which need not share a disk with us
+    response = requests.get(f"{BACKEND_URL}/jobs/{job_id}/subtitles", params={"format": "srt"})
+    if response.status_code != 200:
+        logging.error(f"Fetching subtitles of job {job_id} failed: {response.text}")
+        return None
+    return response.content
+
+
+class VideoProcessor(VideoProcessorBase):
+    # Frames are queued for the recorder's writer thread and shown unchanged
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def recv(self, frame):
+        self.recorder.add_video(frame)
+        return frame
+
+
+class AudioProcessor(AudioProcessorBase):
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def recv(self, frame):
+        self.recorder.add_audio(frame)
+        return frame
+
+
+def new_recorder():
+    return StreamingRecorder(
+        os.path.join(cfg.recording.directory, f"{uuid.uuid4()}.mp4"),
+        queue_size=cfg.recording.queue_size,
+        video_codec=cfg.recording.video_codec,
+        video_options=cfg.recording.video_options,
+        audio_codec=cfg.recording.audio_codec,
+    )
 
 
 def get_video_duration(video_url):
@@ -49,38 +161,6 @@ def subtitle():
         horizontal=True,
     )
 
-    # Define the video processor class
-    class VideoProcessor(VideoProcessorBase):
-        def __init__(self):
-            self.frames = []
-            self.recording = False
-
-        def recv(self, frame):
-            img = frame.to_ndarray(format="bgr24")
-            if self.recording:
-                self.frames.append(img)
-            return av.VideoFrame.from_ndarray(img, format="bgr24")
-
-        def on_start(self):
-            self.recording = True
-            self.frames = []
-
-        def on_stop(self):
-            self.recording = False
-            video_path = "output_video.mp4"
-
-            if self.frames:
-                height, width, _ = self.frames[0].shape
-                out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (width, height))
-
-                for frame in self.frames:
-                    out.write(frame)
-
-                out.release()
-                st.success(f"Video saved at {video_path}")
-            else:
-                st.error("No frames captured")
-
     # Configure the WebRTC streamer
     RTC_CONFIGURATION = RTCConfiguration(
         {"iceServers": [{"urls": ["stun:stun.l.google.com:19302"]}]}
@@ -98,22 +178,16 @@ def subtitle():
         )
         if uploaded_file:
             logging.info("User selected to upload video")
-            if "video_path" not in st.session_state:
-                video_path = os.path.join(os.getcwd(), "video", f"{uuid.uuid4()}.mp4")
-                with open(video_path, "wb") as buffer:
-                    buffer.write(uploaded_file.getvalue())
-                st.session_state.video_path = video_path
-
-            video_path = st.session_state.video_path
-            st.video(video_path, start_time=0)
+            st.video(uploaded_file, start_time=0)
 
     elif selected_method == "Enter YouTube Link":
         logging.info("User selected to enter YouTube link")
         url = st.text_input("Enter YouTube Link")
         if url:
             is_valid_youtube_url(url)
-            if "youtube_video_path" not in st.session_state:
+            if st.session_state.get("youtube_url") != url:
                 video_path = download_video(url)
+                st.session_state.youtube_url = url
                 st.session_state.youtube_video_path = video_path
                 st.success("Video downloaded successfully.")
             video_path = st.session_state.youtube_video_path
@@ -124,16 +198,42 @@ def subtitle():
     
     elif selected_method == "Record Video":
         logging.info("User selected to record a video")
-        # Initialize the video processor
+        recording = st.session_state.setdefault("recording", {"recorder": None})
+
+        def recorder():
+            # every call to the camera is recorded to a new file
+            if recording["recorder"] is None or recording["recorder"].stopped:
+                recording["recorder"] = new_recorder()
+            return recording["recorder"]
+
         ctx = webrtc_streamer(
             key="example",
             mode=WebRtcMode.SENDRECV,
             rtc_configuration=RTC_CONFIGURATION,
-            video_processor_factory=VideoProcessor,
-            media_stream_constraints={"video": True, "audio": False},
-            async_processing=True
+            video_processor_factory=lambda: VideoProcessor(recorder()),
+            audio_processor_factory=lambda: AudioProcessor(recorder()),
+            media_stream_constraints={"video": True, "audio": True},
+            # the recorded audio is sent back too; muted to avoid an echo
+            video_html_attrs={"autoPlay": True, "controls": False, "muted": True},
+            async_processing=True,
         )
-         
+        current = recording["recorder"]
+        if not ctx.state.playing and current is not None and current.started:
+            # stop() only flushes the encoders, the frames are already on disk
+            recorded_video_path = current.stop()
+            if recorded_video_path is None:
+                st.error("Recording failed")
+            else:
+                recorded_video_path = str(recorded_video_path)
+                stats = current.stats
+                st.success(f"Video saved at {recorded_video_path}")
+                if stats.dropped_video or stats.dropped_audio:
+                    st.warning(
+                        f"{stats.dropped_video} video and {stats.dropped_audio} audio frames were dropped"
+                        " because encoding fell behind"
+                    )
+                video_path = recorded_video_path
+                st.video(video_path, start_time=0)
 
     if video_path or uploaded_file or recorded_video_path:
         st.success("Step 1 Completed!")
@@ -151,13 +251,37 @@ def subtitle():
             # Step 3: Select Language
             st.header("Step 3: Select Your Language ✨")
 
+            # The media is streamed to the backend once and referenced by its
+            # upload id; a different file, link or recording needs its own
+            # upload and language detection
+            if uploaded_file:
+                source = (uploaded_file.name, uploaded_file.size)
+            else:
+                source = url or video_path
+            if st.session_state.get("upload_source") != source:
+                st.session_state.upload_source = source
+                st.session_state.pop("upload_id", None)
+                st.session_state.pop("detected_lang", None)
+                st.session_state.pop("lang", None)
+            if "upload_id" not in st.session_state:
+                with st.spinner("Uploading..."):
+                    if uploaded_file:
+                        uploaded_file.seek(0)
+                        upload_id = upload_media(uploaded_file, uploaded_file.name)
+                    else:
+                        upload_id = upload_media(video_path, os.path.basename(video_path))
+                    st.session_state.upload_id = upload_id
+            upload_id = st.session_state.upload_id
+            if upload_id is None:
+                st.error("Upload failed !")
+                return
+
             # Add a spinner to indicate language detection is in progress
             if "detected_lang" not in st.session_state:
                 with st.spinner("Detecting language..."):
 
-                    # Extract audio and detect language
-                    input_file = extract_audio_from_video(video_path)
-                    detected_lang = identify_language_from_audio(str(input_file))
+                    # Detect language on the backend with the selected model
+                    detected_lang = detect_language(upload_id, model_selected)
                     st.session_state.detected_lang = detected_lang
 
             detected_lang = st.session_state.detected_lang
@@ -254,39 +378,15 @@ def subtitle():
                 if transcribe_button:
                     with st.spinner("Transcribing..."):
 
-                        if selected_method == "Upload video" and uploaded_file:
-
-                            data = {
-                                "input_file_path": video_path,
-                                "output_file_path": "",
-                                "model_size": model_selected,
-                                "language": st.session_state.lang,
-                            }
-                            response = requests.post(BACKEND_URL, data=data)
-
-                        elif selected_method == "Enter YouTube Link" and url:
-
-                            data = {
-                                "input_file_path": video_path,
-                                "output_file_path": "",
-                                "model_size": model_selected,
-                                "language": st.session_state.lang,
-                            }
-                            response = requests.post(BACKEND_URL, data=data)
-
-                        elif selected_method == "Record Video" and input_file:
-
-                            data = {
-                                "input_file_path": video_path,
-                                "output_file_path": "",
-                                "model_size": model_selected,
-                                "language": st.session_state.lang,
-                            }
-                        if response.status_code == 200:
+                        data = {
+                            "upload_id": upload_id,
+                            "model_size": model_selected,
+                            "language": st.session_state.lang,
+                        }
+                        result = run_subtitle_job(data)
+                        if result:
                             st.success("Subtitles generated successfully !")
-                            result = response.json()["output_file_path"]
-                            with open(result, "rb") as file:
-                                file_content = file.read()
+                            file_content = result
 
                             st.download_button(
                                 label="Download subtitle file",
@@ -294,10 +394,10 @@ def subtitle():
                                 file_name="subtitles.txt",
                                 mime="text/plain",
                             )
-                            st.video(video_path, start_time=0, subtitles="")
+                            st.video(uploaded_file or video_path, start_time=0, subtitles="")
                             # st.video(video_path, start_time=0, subtitles=file_content)
                             logging.info("Subtitles generated ")
                             
                         else:
-                            logging.error("Transcription failed with response status: {response.status_code}")
+                            logging.error("Transcription failed")
                             st.error("Transcription Failed  !")
@@ -0,0 +1,152 @@
+import re
+import shutil
+import subprocess
+
+import numpy as np
+
+from subtitles_generator.metrics import AUDIO_DECODE_SECONDS
+
+
+def ffmpeg_executable() -> str:
+    executable = shutil.which("ffmpeg")
+    if executable:
+        return executable
+    # fall back to the binary moviepy/imageio already depend on
+    import imageio
+
+    imageio.plugins.ffmpeg.download()
+    return imageio.plugins.ffmpeg.get_exe()
+
+
+def ffmpeg_decode_command(
+    path, sampling_rate: int = 16000, offset: float = None, duration: float = None, output: str = "-"
+) -> list:
+    # `path` may be "pipe:0" to decode from stdin; samples go to stdout unless `output` is a file
+    command = [ffmpeg_executable(), "-nostdin", "-loglevel", "error"]
+    if offset:
+        command += ["-ss", str(offset)]
+    command += ["-i", str(path)]
+    if duration is not None:
+        command += ["-t", str(duration)]
+    return command + ["-vn", "-ac", "1", "-ar", str(sampling_rate), "-f", "f32le", "-y", str(output)]
+
+
+def decode_audio(
+    path, sampling_rate: int = 16000, offset: float = None, duration: float = None
+) -> np.ndarray:
+    # Decodes any container ffmpeg understands straight into mono float32
+    # samples at `sampling_rate`, without writing an intermediate file
+    with AUDIO_DECODE_SECONDS.time(mode="full"):
+        process = subprocess.run(
+            ffmpeg_decode_command(path, sampling_rate, offset, duration), capture_output=True
+        )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Failed to decode audio from {path}: {process.stderr.decode(errors='ignore').strip()}"
+        )
+    return np.frombuffer(process.stdout, dtype=np.float32)
+
+
+class MediaSlice:
+    # `duration` seconds of a media file from `offset` on, or everything
+    # after `offset` when `duration` is None. Accepted wherever a media path
+    # is, so a part of a file can be streamed like a whole one.
+
+    def __init__(self, path, offset: float = 0.0, duration: float = None):
+        self.path = str(path)
+        self.offset = offset
+        self.duration = duration
+
+    def __str__(self):
+        return f"{self.path}[{self.offset}s+{self.duration}s]"
+
+
+def iter_audio_windows(audio, sampling_rate: int = 16000, window_samples: int = 16000 * 60):
+    # Yields consecutive windows of at most `window_samples` samples. Arrays
+    # (including np.memmap) are sliced without copying; media files and
+    # MediaSlices are streamed from ffmpeg so only one window is held in
+    # memory at a time.
+    if isinstance(audio, np.ndarray):
+        for start in range(0, audio.shape[0], window_samples):
+            yield audio[start : start + window_samples]
+        return
+
+    if isinstance(audio, MediaSlice):
+        command = ffmpeg_decode_command(audio.path, sampling_rate, audio.offset, audio.duration)
+        # ffmpeg may overshoot -t by a few samples that belong to the next slice
+        remaining = None if audio.duration is None else int(audio.duration * sampling_rate)
+    else:
+        command = ffmpeg_decode_command(audio, sampling_rate)
+        remaining = None
+    window_bytes = window_samples * np.dtype(np.float32).itemsize
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while remaining is None or remaining > 0:
+            with AUDIO_DECODE_SECONDS.time(mode="window"):
+                data = process.stdout.read(window_bytes)
+            if not data:
+                break
+            window = np.frombuffer(data, dtype=np.float32)
+            if remaining is not None:
+                window = window[:remaining]
+                remaining -= window.shape[0]
+            yield window
+        if remaining is not None and remaining <= 0:
+            # the rest of the output is not needed
+            return
+        if process.wait() != 0:
+            raise RuntimeError(
+                f"Failed to decode audio from {audio}: {process.stderr.read().decode(errors='ignore').strip()}"
+            )
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+
+def iter_overlapping_windows(
+    audio, sampling_rate: int = 16000, window_samples: int = 16000 * 30, overlap_samples: int = 0
+):
+    # Yields (start sample, window) pairs where consecutive windows share
+    # `overlap_samples` samples. Only the last window may be shorter.
+    stride = window_samples - overlap_samples
+    buffer = np.zeros(0, dtype=np.float32)
+    start = 0
+    for block in iter_audio_windows(audio, sampling_rate, stride):
+        buffer = np.concatenate([buffer, block])
+        while buffer.shape[0] >= window_samples:
+            yield start, buffer[:window_samples]
+            buffer = buffer[stride:]
+            start += stride
+    # whatever is left holds audio no earlier window has covered
+    if buffer.shape[0] > overlap_samples or (start == 0 and buffer.shape[0]):
+        yield start, buffer
+
+
+def probe_duration(path) -> float:
+    # container duration in seconds as reported by ffmpeg, None if unknown
+    process = subprocess.run(
+        [ffmpeg_executable(), "-nostdin", "-hide_banner", "-i", str(path)],
+        capture_output=True,
+    )
+    match = re.search(
+        r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", process.stderr.decode(errors="ignore")
+    )
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def count_samples(audio, sampling_rate: int = 16000) -> int:
+    if isinstance(audio, np.ndarray):
+        return audio.shape[0]
+    if isinstance(audio, MediaSlice):
+        if audio.duration is not None:
+            return int(audio.duration * sampling_rate)
+        duration = probe_duration(audio.path)
+        return None if duration is None else max(0, int(round((duration - audio.offset) * sampling_rate)))
+    duration = probe_duration(audio)
+    return None if duration is None else int(round(duration * sampling_rate))
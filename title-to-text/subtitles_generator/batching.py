@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import torch
+
+
+class _Request:
+    __slots__ = ("features", "stats", "future")
+
+    def __init__(self, features: torch.Tensor, stats=None):
+        self.features = features
+        self.stats = stats
+        self.future = Future()
+
+
+class _Dispatcher:
+    # Collects chunks for one (model, decoder prompt, decoding settings) key and runs them
+    # through `generate` together. Chunks are taken round-robin from the
+    # submitting jobs so a long file cannot starve a short one.
+
+    def __init__(self, scheduler, key, model, forced_decoder_ids, decoding):
+        self.scheduler = scheduler
+        self.key = key
+        self.model = model
+        self.forced_decoder_ids = forced_decoder_ids
+        self.decoding = decoding
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name=f"batcher-{model.model_name}", daemon=True
+        )
+        self._thread.start()
+
+    def put(self, job, requests: list):
+        with self._cond:
+            self._jobs.setdefault(job, deque()).extend(requests)
+            self._pending += len(requests)
+            self._cond.notify()
+
+    def _take(self, limit: int) -> list:
+        batch = []
+        while len(batch) < limit and self._jobs:
+            job, requests = self._jobs.popitem(last=False)
+            batch.append(requests.popleft())
+            if requests:
+                self._jobs[job] = requests
+        self._pending -= len(batch)
+        return batch
+
+    def _collect(self):
+        max_batch_size = self.scheduler.max_batch_size
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(self.scheduler.idle_timeout)
+                if not self._pending:
+                    return None
+            deadline = time.monotonic() + self.scheduler.max_wait
+            while self._pending < max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._take(max_batch_size)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                if self.scheduler._retire(self):
+                    return
+                continue
+
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                texts = self.model.generate_batch(
+                    torch.stack([r.features for r in batch]),
+                    forced_decoder_ids=self.forced_decoder_ids,
+                    decoding=self.decoding,
+                    decoding_stats=[r.stats for r in batch],
+                )
+            except Exception as e:
+                logging.error(f"Batch of {len(batch)} chunks failed: {e}")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, text in zip(batch, texts):
+                request.future.set_result(text)
+
+
+class BatchScheduler:
+    # Shares `generate` calls between concurrent jobs. A batch is flushed
+    # when it reaches `max_batch_size` chunks or `max_wait_ms` after its
+    # first chunk arrived, whichever comes first.
+
+    def __init__(self, max_batch_size: int = 16, max_wait_ms: float = 20, idle_timeout: float = 30):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.idle_timeout = idle_timeout
+        self._dispatchers = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self, model, features: torch.Tensor, forced_decoder_ids, decoding: dict = None, stats=None
+    ) -> list[Future]:
+        # one future per chunk (row of `features`), resolved with its text;
+        # only chunks with the same prompt and decoding settings share a batch
+        key = (
+            id(model),
+            tuple(map(tuple, forced_decoder_ids or ())),
+            tuple(sorted((decoding or {}).items())),
+        )
+        requests = [_Request(chunk, stats) for chunk in features]
+        with self._lock:
+            dispatcher = self._dispatchers.get(key)
+            if dispatcher is None or dispatcher.model is not model:
+                dispatcher = _Dispatcher(self, key, model, forced_decoder_ids, decoding)
+                self._dispatchers[key] = dispatcher
+            dispatcher.put(object(), requests)
+        return [r.future for r in requests]
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(dispatcher._pending for dispatcher in self._dispatchers.values())
+
+    def _retire(self, dispatcher) -> bool:
+        # idle dispatchers exit so evicted models are not kept alive
+        with self._lock:
+            with dispatcher._cond:
+                if dispatcher._pending:
+                    return False
+                if self._dispatchers.get(dispatcher.key) is dispatcher:
+                    del self._dispatchers[dispatcher.key]
+                return True
@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import logging
+import pathlib
+import threading
+
+import numpy as np
+
+from subtitles_generator.transcript import Transcript
+
+
+def audio_fingerprint(source, block_size: int = 1024**2) -> str:
+    # Media files are hashed by their bytes in blocks, so computing the key
+    # never decodes the input; uploads are keyed by their stored media file
+    # the same way. Samples are only hashed for audio that exists nowhere
+    # but in memory.
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(source, np.ndarray):
+        digest.update(b"samples")
+        for start in range(0, source.shape[0], block_size):
+            digest.update(np.ascontiguousarray(source[start : start + block_size], dtype=np.float32).tobytes())
+    else:
+        digest.update(b"file")
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    # On-disk cache of finished transcripts, one JSON file per key.
+    # Keys hash the audio (see audio_fingerprint) with every setting that changes
+    # the output; least recently used entries are removed once the
+    # directory grows past `max_bytes`.
+
+    def __init__(self, directory, max_bytes: int = 512 * 1024**2):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(source, **settings) -> str:
+        digest = hashlib.blake2b(audio_fingerprint(source).encode(), digest_size=20)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Transcript:
+        path = self.directory / f"{key}.json"
+        try:
+            with open(path, encoding="utf-8") as f:
+                transcript = Transcript.from_dict(json.load(f)["transcript"])
+            # mtime doubles as the last-access time used for eviction
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            # entries written before transcripts were cached count as misses
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return transcript
+
+    def put(self, key: str, transcript: Transcript, **metadata):
+        path = self.directory / f"{key}.json"
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"transcript": transcript.as_dict(), "metadata": metadata}, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _entries(self) -> list:
+        # (mtime, size, path) of every entry; another process or thread may
+        # remove files while the directory is listed
+        entries = []
+        for entry in self.directory.glob("*.json"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+                logging.info(f"Evicted {entry.name} from transcript cache")
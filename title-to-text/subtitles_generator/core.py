@@ -1,60 +1,756 @@
+import copy
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import torch
-import librosa
 from tqdm import tqdm
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
+from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE
+
+from subtitles_generator.audio import (
+    count_samples,
+    decode_audio,
+    iter_audio_windows,
+    iter_overlapping_windows,
+)
+from subtitles_generator.decoding import (
+    DecodingStats,
+    Hypothesis,
+    TokenLogprobRecorder,
+    generate_kwargs,
+    record_sequences,
+    resolve_decoding,
+)
+from subtitles_generator.features import log_mel_spectrogram, split_audio
+from subtitles_generator.metrics import (
+    ASSISTED_ACCEPTED_TOKENS,
+    ASSISTED_DRAFTED_TOKENS,
+    CHUNKS_SKIPPED,
+    CHUNKS_TRANSCRIBED,
+    FEATURE_EXTRACTION_SECONDS,
+    GENERATE_BATCH_SECONDS,
+    GENERATE_BATCH_SIZE,
+)
+from subtitles_generator.pipeline import Pipeline, PipelineStats
+from subtitles_generator.vad import speech_chunks
+
+# fp32: full weights, bf16: bfloat16 weights and activations (CPUs with
+# AVX512-BF16/AMX or GPUs), int8: dynamically quantized linear layers (CPU)
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# names from conf/config.yaml that Whisper knows under another name
+LANGUAGE_ALIASES = {"creole": "haitian creole"}
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def bf16_supported(device: torch.device) -> bool:
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def stitch_segments(segments, window_start, window_end, next_start, cut, tolerance=0.5):
+    # Picks the segments of one long-form window that the previous window
+    # did not already cover. `segments` carry times relative to the window
+    # and the last one has no end when the window stops mid-sentence.
+    # `next_start` is None for the final window. Returns the segments with
+    # absolute times and the time from which the next window takes over.
+    kept, trailing = [], None
+    floor = cut
+    for start, end, text in segments:
+        start += window_start
+        if end is None:
+            trailing = (start, text)
+            continue
+        end = min(end + window_start, window_end)
+        # Segments must not go back in time or repeat what is already kept.
+        # One that started well before the cut (the rest of a sentence the
+        # previous window committed up to its end) is clipped to the cut,
+        # as long as it reaches clearly past it.
+        if text and end > max(start, floor) + (0 if start >= floor - tolerance else tolerance):
+            kept.append((max(start, floor), end, text))
+            floor = end
+
+    if next_start is None:
+        handover = window_end
+    elif trailing is not None and trailing[0] >= next_start:
+        # the next window hears this sentence from its beginning
+        handover = trailing[0]
+        trailing = None
+    else:
+        handover = (next_start + window_end) / 2
+
+    kept = [segment for segment in kept if segment[0] < handover]
+    floor = max([cut] + [end for _, end, _ in kept])
+    if trailing is not None and trailing[1] and window_end > floor + (0 if trailing[0] >= floor - tolerance else tolerance):
+        kept.append((max(trailing[0], floor), window_end, trailing[1]))
+        handover = window_end
+    return kept, max([handover] + [end for _, end, _ in kept])
+
+
+class AssistedDecodingStats:
+    # Token counts from assisted decoding. A verification step is one
+    # forward pass of the main decoder and yields one token of its own;
+    # every further token it emits was drafted and accepted.
+
+    def __init__(self):
+        self.chunks = 0
+        self.tokens = 0
+        self.drafted = 0
+        self.verification_steps = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int, drafted: int, verification_steps: int):
+        with self._lock:
+            self.chunks += 1
+            self.tokens += tokens
+            self.drafted += drafted
+            self.verification_steps += verification_steps
+
+    @property
+    def accepted(self) -> int:
+        return max(0, self.tokens - self.verification_steps)
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.drafted if self.drafted else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "chunks": self.chunks,
+            "tokens": self.tokens,
+            "drafted": self.drafted,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.acceptance_rate, 4),
+            "tokens_per_verification": round(self.tokens / self.verification_steps, 4)
+            if self.verification_steps
+            else 0.0,
+        }
 
 
 class Model:
-    def __init__(self, model_name: str, lang: str):
-        self.model = WhisperForConditionalGeneration.from_pretrained(model_name)
+    def __init__(
+        self,
+        model_name: str,
+        lang: str = None,
+        device: str = None,
+        precision: str = "fp32",
+        optimize: bool = False,
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"Precision {precision} is not supported. Supported precisions are {list(PRECISIONS)}"
+            )
+        self.model_name = model_name
+        self.precision = precision
+        self.optimize = optimize
+        self.model = self.load_weights(model_name)
         self.processor = WhisperProcessor.from_pretrained(model_name)
-        self.forced_decoder_ids = self.processor.get_decoder_prompt_ids(
-            language=lang, task="transcribe"
-        )
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = torch.device(device or default_device())
         self.model.to(self.device)
+        self.model.eval()
+        self.apply_precision()
+        self.dtype = next(self.model.parameters()).dtype
+
+        # prompt ids are cheap to build but are needed on every call,
+        # so they are kept per language instead of being fixed at load time
+        self._prompt_ids = {}
+        self.forced_decoder_ids = self.get_prompt_ids(lang) if lang else None
+        self._language_cache = OrderedDict()
+        self._language_lock = threading.Lock()
 
-    def get_features(self, path: str, chunk_size: int = 4, sampling_rate: int = 16000):
-        speech_array, sampling_rate = librosa.load(path, sr=sampling_rate)
-        chunks = np.array_split(
-            speech_array,
-            speech_array.shape[0] // (chunk_size * sampling_rate)
-            + (speech_array.shape[0] % (chunk_size * sampling_rate) > 0),
+        self.optimizations = {}
+        if optimize:
+            self.apply_optimizations()
+
+    def load_weights(self, model_name: str):
+        if self.optimize:
+            # fused scaled-dot-product attention, on transformers versions
+            # that implement it for Whisper
+            try:
+                return WhisperForConditionalGeneration.from_pretrained(
+                    model_name, attn_implementation="sdpa"
+                )
+            except (TypeError, ValueError, ImportError) as e:
+                logging.warning(f"SDPA attention is not available for {model_name}, using eager attention: {e}")
+        return WhisperForConditionalGeneration.from_pretrained(model_name)
+
+    def apply_precision(self):
+        if self.precision == "int8":
+            if self.device.type != "cpu":
+                raise ValueError("int8 dynamic quantization is only available on CPU")
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        elif self.precision == "bf16":
+            if bf16_supported(self.device):
+                self.model.to(torch.bfloat16)
+            else:
+                logging.warning(f"bf16 is not supported on {self.device}, keeping fp32 weights")
+
+    def apply_optimizations(self):
+        # Compiled encoder/decoder forwards, falling back to the eager path
+        # when this torch build cannot compile them; `optimizations` records
+        # what is in effect. The KV cache stays dynamic.
+        self.optimizations["attention"] = getattr(self.model.config, "_attn_implementation", "eager")
+
+        # the forwards are replaced on the modules themselves so hooks,
+        # weights and the module tree stay the same
+        self._eager_forwards = [
+            (module, module.forward) for module in (self.model.get_encoder(), self.model.get_decoder())
+        ]
+        try:
+            for module, forward in self._eager_forwards:
+                # the decoder sees a longer cache at every step
+                module.forward = torch.compile(forward, dynamic=module is self.model.get_decoder())
+            self.warmup()
+        except Exception as e:
+            logging.warning(f"torch.compile failed for {self.model_name}, using eager forwards: {e}")
+            self.restore_eager_forwards()
+            self.optimizations["compiled"] = False
+        else:
+            self.optimizations["compiled"] = True
+        logging.info(f"Optimized inference for {self.model_name}: {self.optimizations}")
+
+    def restore_eager_forwards(self):
+        for module, forward in self._eager_forwards:
+            module.forward = forward
+
+    def warmup(self, batch_sizes=(1,), chunk_size: int = 2, sampling_rate: int = 16000):
+        # Short generate calls on silence for each batch size the server
+        # will run, so first-call allocations and compilation for those
+        # shapes happen before the first request
+        for batch_size in batch_sizes:
+            silence = np.zeros(batch_size * chunk_size * sampling_rate, dtype=np.float32)
+            features = self.get_features(silence, chunk_size, sampling_rate)
+            self.generate_batch(features, self.get_prompt_ids("english"), decoding={"max_new_tokens": 8})
+
+    def get_prompt_ids(self, lang: str):
+        if lang not in self._prompt_ids:
+            self._prompt_ids[lang] = self.processor.get_decoder_prompt_ids(
+                language=lang, task="transcribe"
+            )
+        return self._prompt_ids[lang]
+
+    def memory_footprint(self) -> int:
+        # size in bytes of the weights and buffers held by the model;
+        # quantized linear layers keep theirs as a (weight, bias) tuple
+        tensors = []
+        for value in self.model.state_dict().values():
+            if isinstance(value, tuple):
+                tensors.extend(t for t in value if isinstance(t, torch.Tensor))
+            elif isinstance(value, torch.Tensor):
+                tensors.append(value)
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def get_chunks(
+        self, audio, chunk_size: int = 4, sampling_rate: int = 16000
+    ) -> np.ndarray:
+        # `audio` is either a media file path or samples already at `sampling_rate`
+        if isinstance(audio, np.ndarray):
+            speech_array = audio
+        else:
+            speech_array = decode_audio(audio, sampling_rate)
+        return split_audio(speech_array, chunk_size * sampling_rate)
+
+    def get_features(
+        self, audio, chunk_size: int = 4, sampling_rate: int = 16000
+    ) -> torch.Tensor:
+        chunks = self.get_chunks(audio, chunk_size, sampling_rate)
+        return log_mel_spectrogram(chunks, self.processor.feature_extractor)
+
+    def language_token_ids(self, languages) -> dict:
+        tokenizer = self.processor.tokenizer
+        token_ids = {}
+        for name in languages:
+            code = TO_LANGUAGE_CODE.get(LANGUAGE_ALIASES.get(name, name))
+            if code is None:
+                continue
+            token_id = tokenizer.convert_tokens_to_ids(f"<|{code}|>")
+            if token_id != tokenizer.unk_token_id:
+                token_ids[name] = token_id
+        return token_ids
+
+    def detect_language(self, audio, languages, sampling_rate: int = 16000) -> dict:
+        # Probabilities over `languages` from one decoder step on the first
+        # 30 s window, the same way Whisper picks a language itself.
+        # Results are memoized per audio window and language list.
+        feature_extractor = self.processor.feature_extractor
+        if isinstance(audio, np.ndarray):
+            window = audio[: feature_extractor.n_samples]
+        else:
+            window = decode_audio(
+                audio, sampling_rate, duration=feature_extractor.chunk_length
+            )[: feature_extractor.n_samples]
+        window = np.ascontiguousarray(window, dtype=np.float32)
+
+        languages = tuple(languages)
+        key = (hashlib.sha1(window.tobytes()).hexdigest(), languages)
+        with self._language_lock:
+            if key in self._language_cache:
+                self._language_cache.move_to_end(key)
+                return self._language_cache[key]
+
+        token_ids = self.language_token_ids(languages)
+        input_features = log_mel_spectrogram(
+            split_audio(window, feature_extractor.n_samples), feature_extractor
+        )
+        decoder_input_ids = torch.tensor(
+            [[self.model.generation_config.decoder_start_token_id]], device=self.device
         )
-        input_features_chunks = [
-            self.processor(
-                chunk, sampling_rate=sampling_rate, return_tensors="pt"
-            ).input_features
-            for chunk in chunks
+        with torch.inference_mode():
+            logits = self.model(
+                input_features=input_features.to(self.device, self.dtype),
+                decoder_input_ids=decoder_input_ids,
+            ).logits[0, -1]
+        probabilities = logits[list(token_ids.values())].float().softmax(dim=-1)
+        result = dict(zip(token_ids, probabilities.tolist()))
+
+        with self._language_lock:
+            self._language_cache[key] = result
+            while len(self._language_cache) > 128:
+                self._language_cache.popitem(last=False)
+        return result
+
+    def check_assistant(self, assistant: "Model"):
+        # the draft model has to read the same features and speak the same vocabulary
+        config, draft_config = self.model.config, assistant.model.config
+        if draft_config.vocab_size != config.vocab_size:
+            raise ValueError(
+                f"{assistant.model_name} cannot draft for {self.model_name}: vocabulary sizes differ "
+                f"({draft_config.vocab_size} vs {config.vocab_size})"
+            )
+        if draft_config.num_mel_bins != config.num_mel_bins:
+            raise ValueError(
+                f"{assistant.model_name} cannot draft for {self.model_name}: mel bins differ "
+                f"({draft_config.num_mel_bins} vs {config.num_mel_bins})"
+            )
+
+    def assisted_max_length(self) -> int:
+        return self.model.config.max_target_positions // 2
+
+    def prompt_length(self, forced_decoder_ids=None) -> int:
+        # start token plus the forced language/task/timestamp tokens
+        if forced_decoder_ids is None:
+            forced_decoder_ids = self.model.generation_config.forced_decoder_ids
+        return 1 + len(forced_decoder_ids or ())
+
+    def assisted_generate(self, input_features: torch.Tensor, assistant: "Model", stats=None, **kwargs) -> list:
+        # Speculative decoding: `assistant` proposes tokens and this model
+        # verifies them, so the output is this model's greedy output.
+        # transformers runs it one sequence at a time. Decoder passes are
+        # counted with forward hooks, only on this thread since both models
+        # may serve other jobs at the same time.
+        thread = threading.get_ident()
+        calls = {"main": 0, "draft": 0}
+
+        def counter(name):
+            def hook(module, args, output):
+                if threading.get_ident() == thread:
+                    calls[name] += 1
+
+            return hook
+
+        # the draft keeps proposing past the main model's length limit, which
+        # transformers does not guard against, so leave it room to overshoot
+        if "max_new_tokens" not in kwargs:
+            kwargs.setdefault("max_length", self.assisted_max_length())
+        handles = [
+            self.model.get_decoder().register_forward_hook(counter("main")),
+            assistant.model.get_decoder().register_forward_hook(counter("draft")),
         ]
+        sequences = []
+        try:
+            for row in input_features:
+                calls.update(main=0, draft=0)
+                sequence = self.model.generate(row[None], assistant_model=assistant.model, **kwargs)[0]
+                sequences.append(sequence)
+
+                tokens = sequence.shape[0] - 1
+                accepted = max(0, tokens - calls["main"])
+                ASSISTED_DRAFTED_TOKENS.inc(calls["draft"], model=self.model_name)
+                ASSISTED_ACCEPTED_TOKENS.inc(accepted, model=self.model_name)
+                if stats is not None:
+                    stats.add(tokens, calls["draft"], calls["main"])
+        finally:
+            for handle in handles:
+                handle.remove()
+        return sequences
+
+    def generate_batch(
+        self,
+        input_features: torch.Tensor,
+        forced_decoder_ids=None,
+        assistant: "Model" = None,
+        assistant_stats: AssistedDecodingStats = None,
+        decoding: dict = None,
+        decoding_stats: list = None,
+    ) -> list[str]:
+        # `decoding` holds settings from resolve_decoding; `decoding_stats`
+        # has one DecodingStats (or None) per row since a batch may mix jobs
+        decoding = decoding or {}
+        eos_token_id = self.processor.tokenizer.eos_token_id
+        prompt_length = self.prompt_length(forced_decoder_ids)
+        max_length = self.assisted_max_length() if assistant else self.model.generation_config.max_length
+        # assisted decoding verifies several tokens per step, so per-step scores do not map to tokens
+        recorder = TokenLogprobRecorder() if assistant is None else None
+        kwargs = generate_kwargs(decoding, eos_token_id, prompt_length, max_length, recorder)
+
+        input_features = input_features.to(self.device, self.dtype)
+        with GENERATE_BATCH_SECONDS.time(model=self.model_name), torch.inference_mode(self.optimize):
+            if assistant is not None:
+                predicted_ids = self.assisted_generate(
+                    input_features,
+                    assistant,
+                    assistant_stats,
+                    forced_decoder_ids=forced_decoder_ids,
+                    **kwargs,
+                )
+            else:
+                predicted_ids = self.model.generate(
+                    input_features, forced_decoder_ids=forced_decoder_ids, **kwargs
+                )
+        GENERATE_BATCH_SIZE.observe(input_features.shape[0], model=self.model_name)
+        CHUNKS_TRANSCRIBED.inc(input_features.shape[0], model=self.model_name)
+        record_sequences(
+            predicted_ids,
+            decoding,
+            decoding_stats or [None] * input_features.shape[0],
+            eos_token_id,
+            prompt_length,
+            max_length,
+        )
+        texts = self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+        if recorder is None:
+            return texts
+        token_logprobs = recorder.token_logprobs(predicted_ids, eos_token_id, prompt_length)
+        return [Hypothesis(text, logprobs) for text, logprobs in zip(texts, token_logprobs)]
+
+    def timestamp_segments(self, token_ids) -> list:
+        # (start, end, text) for every pair of timestamp tokens; text after
+        # the last timestamp becomes a segment without an end
+        timestamp_begin = self.model.generation_config.no_timestamps_token_id + 1
+        eos_token_id = self.processor.tokenizer.eos_token_id
+        segments, tokens = [], []
+        start = last_time = None
+        for token in token_ids:
+            if token >= timestamp_begin:
+                time = (token - timestamp_begin) * 0.02
+                if start is None:
+                    start = time
+                else:
+                    if tokens:
+                        segments.append((start, time, self.processor.decode(tokens).strip()))
+                    start, tokens = None, []
+                last_time = time
+            elif token < eos_token_id and last_time is not None:
+                if start is None:
+                    start = last_time
+                tokens.append(token)
+        if tokens:
+            segments.append((start, None, self.processor.decode(tokens).strip()))
+        return segments
 
-        input_features_chunks = []
-        for chunk in chunks:
-            input_features_chunks.append(
-                self.processor(
-                    chunk, sampling_rate=sampling_rate, return_tensors="pt"
-                ).input_features
+    def generate_segments(
+        self,
+        input_features: torch.Tensor,
+        lang: str = None,
+        decoding: dict = None,
+        decoding_stats: DecodingStats = None,
+    ) -> list[list]:
+        # Whisper decoding with timestamp tokens, one segment list per window.
+        # generate() writes the language and task into the generation config
+        # it is given, so each call gets its own copy.
+        decoding = decoding or {}
+        generation_config = copy.deepcopy(self.model.generation_config)
+        eos_token_id = self.processor.tokenizer.eos_token_id
+        # start, language and task tokens
+        prompt_length = 3
+        kwargs = generate_kwargs(decoding, eos_token_id, prompt_length, generation_config.max_length)
+        with GENERATE_BATCH_SECONDS.time(model=self.model_name), torch.inference_mode(self.optimize):
+            predicted_ids = self.model.generate(
+                input_features.to(self.device, self.dtype),
+                generation_config=generation_config,
+                return_timestamps=True,
+                language=LANGUAGE_ALIASES.get(lang, lang) if lang else None,
+                task="transcribe",
+                **kwargs,
             )
-        return input_features_chunks
+        GENERATE_BATCH_SIZE.observe(input_features.shape[0], model=self.model_name)
+        CHUNKS_TRANSCRIBED.inc(input_features.shape[0], model=self.model_name)
+        record_sequences(
+            predicted_ids,
+            decoding,
+            [decoding_stats] * input_features.shape[0],
+            eos_token_id,
+            prompt_length,
+            generation_config.max_length,
+        )
+        return [self.timestamp_segments(ids.tolist()) for ids in predicted_ids]
 
-    def transcribe(
+    def generate_texts(
         self,
-        audio_path: str,
+        input_features: torch.Tensor,
+        forced_decoder_ids,
+        batch_size: int = 4,
+        scheduler=None,
+        assistant: "Model" = None,
+        assistant_stats: AssistedDecodingStats = None,
+        decoding: dict = None,
+        decoding_stats: DecodingStats = None,
+    ):
+        # yields one text per feature row, in order
+        n = input_features.shape[0]
+
+        # with a scheduler the chunks are batched together with other jobs;
+        # assisted decoding works on single sequences and skips it
+        if scheduler is not None and assistant is None:
+            futures = scheduler.submit(
+                self, input_features, forced_decoder_ids, decoding=decoding, stats=decoding_stats
+            )
+            try:
+                for future in tqdm(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+            return
+
+        for i in tqdm(range(0, n, batch_size)):
+            batch = input_features[i : i + batch_size]
+            yield from self.generate_batch(
+                batch,
+                forced_decoder_ids,
+                assistant,
+                assistant_stats,
+                decoding,
+                [decoding_stats] * batch.shape[0],
+            )
+
+    def transcribe_stream(
+        self,
+        audio,
         chunk_size: int = 4,
         sampling_rate: int = 16000,
-    ) -> list[str]:
-        input_features_chunks = self.get_features(audio_path, chunk_size, sampling_rate)
-        transcriptions = []
-        n = len(input_features_chunks)
-        for i in tqdm(range(0, n, 4)):
-            predicted_ids = self.model.generate(
-                torch.concat(input_features_chunks[i : i + 4]).to(self.device),
-                forced_decoder_ids=self.forced_decoder_ids,
+        lang: str = None,
+        batch_size: int = 4,
+        scheduler=None,
+        progress_callback=None,
+        vad_options: dict = None,
+        window_chunks: int = 64,
+        assistant: "Model" = None,
+        assistant_stats: AssistedDecodingStats = None,
+        decoding_options: dict = None,
+        decoding_stats: DecodingStats = None,
+        pipeline_options: dict = None,
+        pipeline_stats: PipelineStats = None,
+    ):
+        # Yields (chunk index, text) in order as soon as each batch is decoded.
+        # Audio is read `window_chunks` chunks at a time and features are
+        # computed just before they are decoded, so memory does not grow with
+        # the input length. progress_callback(done, total) is called as chunks
+        # complete and may raise to abort the transcription. With
+        # `vad_options` only chunks with speech reach the model and silent
+        # ones are yielded as None. With an `assistant` model chunks are
+        # decoded speculatively and counts go into `assistant_stats`.
+        # `decoding_options` set the beam width, a token budget per second of
+        # audio and the repetition cut-off; their effect goes into
+        # `decoding_stats`. Unless `pipeline_options` disable it, audio
+        # decoding and feature extraction of the next windows run on
+        # background threads while the current one is in generate; stage
+        # timings go into `pipeline_stats`.
+        decoding = resolve_decoding(decoding_options, chunk_size)
+        if assistant is not None:
+            self.check_assistant(assistant)
+            if decoding.get("num_beams", 1) > 1:
+                raise ValueError("Assisted decoding only supports greedy decoding (num_beams: 1)")
+        forced_decoder_ids = (
+            self.get_prompt_ids(lang) if lang else self.forced_decoder_ids
+        )
+        chunk_samples = chunk_size * sampling_rate
+        n_samples = count_samples(audio, sampling_rate)
+        total = None if n_samples is None else -(-n_samples // chunk_samples)
+
+        def features(window):
+            chunks = split_audio(window, chunk_samples)
+            n = chunks.shape[0]
+            if vad_options is not None:
+                speech_indices = np.flatnonzero(speech_chunks(chunks, sampling_rate, **vad_options))
+                CHUNKS_SKIPPED.inc(n - len(speech_indices))
+            else:
+                speech_indices = np.arange(n)
+            with FEATURE_EXTRACTION_SECONDS.time():
+                input_features = log_mel_spectrogram(
+                    chunks[speech_indices], self.processor.feature_extractor
+                )
+            return n, speech_indices, input_features
+
+        pipeline_options = pipeline_options or {}
+        windows = iter(
+            Pipeline(
+                (
+                    "decode",
+                    iter_audio_windows(audio, sampling_rate, window_chunks * chunk_samples),
+                    pipeline_options.get("decode_queue_depth", 2),
+                ),
+                [("features", features, pipeline_options.get("feature_queue_depth", 2))],
+                consumer="generate",
+                stats=pipeline_stats,
+                threaded=pipeline_options.get("enabled", True),
             )
-            transcription = self.processor.batch_decode(
-                predicted_ids, skip_special_tokens=True
+        )
+
+        offset = skipped = 0
+        try:
+            for n, speech_indices, input_features in windows:
+                skipped += n - len(speech_indices)
+                texts = self.generate_texts(
+                    input_features,
+                    forced_decoder_ids,
+                    batch_size,
+                    scheduler,
+                    assistant,
+                    assistant_stats,
+                    decoding,
+                    decoding_stats,
+                )
+                emitted = 0
+                try:
+                    for chunk_index, text in zip(speech_indices, texts):
+                        for gap_index in range(emitted, chunk_index):
+                            yield offset + gap_index, None
+                        if progress_callback is not None:
+                            progress_callback(offset + chunk_index + 1, max(total or 0, offset + n))
+                        yield offset + int(chunk_index), text
+                        emitted = chunk_index + 1
+                finally:
+                    texts.close()
+                for gap_index in range(emitted, n):
+                    yield offset + gap_index, None
+                offset += n
+        finally:
+            # stops the decode and feature threads when the caller stops early
+            windows.close()
+
+        if vad_options is not None:
+            logging.info(f"{skipped} of {offset} chunks skipped as silence")
+        if progress_callback is not None:
+            progress_callback(offset, offset)
+
+    def transcribe_long_form(
+        self,
+        audio,
+        sampling_rate: int = 16000,
+        lang: str = None,
+        batch_size: int = 4,
+        progress_callback=None,
+        vad_options: dict = None,
+        overlap_seconds: float = 5,
+        decoding_options: dict = None,
+        decoding_stats: DecodingStats = None,
+    ):
+        # Yields (start, end, text) segments in order, times in seconds.
+        # Audio is decoded in full 30 s windows and segment times come from
+        # Whisper's timestamp tokens. Consecutive windows share
+        # `overlap_seconds` so a sentence cut by a window edge is decoded
+        # whole by the next window. With `vad_options` silent windows are
+        # not sent to the model.
+        feature_extractor = self.processor.feature_extractor
+        window_samples = feature_extractor.n_samples
+        overlap_samples = int(overlap_seconds * sampling_rate)
+        if not 0 <= overlap_samples < window_samples:
+            raise ValueError(
+                f"Overlap must be shorter than the {feature_extractor.chunk_length} s window, got {overlap_seconds}"
             )
-            transcriptions.extend(transcription)
+        stride = window_samples - overlap_samples
+        decoding = resolve_decoding(decoding_options, feature_extractor.chunk_length)
+        n_samples = count_samples(audio, sampling_rate)
+        total = None if n_samples is None else max(1, -(-(n_samples - overlap_samples) // stride))
+
+        done = 0
+        cut = 0.0
 
-        return transcriptions
+        def decode(batch, next_start):
+            nonlocal done, cut
+            windows = np.zeros((len(batch), window_samples), dtype=np.float32)
+            for row, (_, samples) in enumerate(batch):
+                windows[row, : samples.shape[0]] = samples
+
+            if vad_options is not None:
+                # judged on the real samples, the zero padding of a short last window would dilute it
+                speech = np.array(
+                    [speech_chunks(samples[None], sampling_rate, **vad_options)[0] for _, samples in batch]
+                )
+                CHUNKS_SKIPPED.inc(int((~speech).sum()))
+            else:
+                speech = np.ones(len(batch), dtype=bool)
+            with FEATURE_EXTRACTION_SECONDS.time():
+                input_features = log_mel_spectrogram(windows[speech], feature_extractor)
+            decoded = iter(self.generate_segments(input_features, lang, decoding, decoding_stats) if speech.any() else [])
+
+            for row, (start, samples) in enumerate(batch):
+                segments = next(decoded) if speech[row] else []
+                following = batch[row + 1][0] if row + 1 < len(batch) else next_start
+                kept, cut = stitch_segments(
+                    segments,
+                    start / sampling_rate,
+                    (start + samples.shape[0]) / sampling_rate,
+                    None if following is None else following / sampling_rate,
+                    cut,
+                )
+                done += 1
+                if progress_callback is not None:
+                    progress_callback(done, max(total or 0, done))
+                yield from kept
+
+        # one window is held back so the final window is known when it is stitched
+        batch = []
+        for window in iter_overlapping_windows(audio, sampling_rate, window_samples, overlap_samples):
+            batch.append(window)
+            if len(batch) > batch_size:
+                yield from decode(batch[:batch_size], batch[batch_size][0])
+                batch = batch[batch_size:]
+        if batch:
+            yield from decode(batch, None)
+        if progress_callback is not None:
+            progress_callback(done, done)
+
+    def transcribe(
+        self,
+        audio,
+        chunk_size: int = 4,
+        sampling_rate: int = 16000,
+        lang: str = None,
+        batch_size: int = 4,
+        scheduler=None,
+        vad_options: dict = None,
+        assistant: "Model" = None,
+        assistant_stats: AssistedDecodingStats = None,
+        decoding_options: dict = None,
+        decoding_stats: DecodingStats = None,
+    ) -> list[str]:
+        return [
+            text
+            for _, text in self.transcribe_stream(
+                audio,
+                chunk_size,
+                sampling_rate,
+                lang,
+                batch_size,
+                scheduler,
+                vad_options=vad_options,
+                assistant=assistant,
+                assistant_stats=assistant_stats,
+                decoding_options=decoding_options,
+                decoding_stats=decoding_stats,
+            )
+        ]
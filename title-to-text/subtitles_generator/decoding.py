@@ -0,0 +1,190 @@
+import math
+import threading
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList
+
+from subtitles_generator.metrics import EARLY_STOPS, TOKENS_SAVED
+
+
+class DecodingStats:
+    # Decode budget counters for one job. Saved tokens are counted against
+    # the default behaviour of running a stopped sequence on to the model's
+    # length limit, which is what a looping sequence does.
+
+    def __init__(self):
+        self.sequences = 0
+        self.tokens = 0
+        self.repetition_stops = 0
+        self.budget_stops = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int, repetition_stop: bool = False, budget_stop: bool = False, tokens_saved: int = 0):
+        with self._lock:
+            self.sequences += 1
+            self.tokens += tokens
+            self.repetition_stops += repetition_stop
+            self.budget_stops += budget_stop
+            self.tokens_saved += tokens_saved
+
+    def as_dict(self) -> dict:
+        return {
+            "sequences": self.sequences,
+            "tokens": self.tokens,
+            "repetition_stops": self.repetition_stops,
+            "budget_stops": self.budget_stops,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+class Hypothesis(str):
+    # Decoded text that also carries the log probability of each generated
+    # token (None when the decoding strategy does not report them). It is a
+    # str everywhere else, so consumers that only want text are unaffected.
+
+    def __new__(cls, text: str, token_logprobs: list = None):
+        hypothesis = super().__new__(cls, text)
+        hypothesis.token_logprobs = token_logprobs
+        return hypothesis
+
+    def __reduce__(self):
+        # keeps the log probabilities when results cross process boundaries
+        return (Hypothesis, (str(self), self.token_logprobs))
+
+
+class TokenLogprobRecorder(LogitsProcessor):
+    # Keeps, for every decoding step, the log probability of the best token
+    # after all other processors ran, which is the token greedy search
+    # picks. Must be the last processor in the list. The maxima stay on the
+    # model's device until token_logprobs() so decoding never waits for a copy.
+
+    def __init__(self):
+        self.steps = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self.steps.append(scores.float().log_softmax(dim=-1).max(dim=-1).values)
+        return scores
+
+    def token_logprobs(self, sequences, eos_token_id: int, prompt_length: int) -> list:
+        # one list per sequence, for the tokens after the prompt up to end of text
+        if not self.steps:
+            return [None] * len(sequences)
+        steps = torch.stack(self.steps, dim=1).cpu().tolist()
+        result = []
+        for row, sequence in enumerate(sequences):
+            tokens = sequence.tolist()
+            end = tokens.index(eos_token_id, 1) if eos_token_id in tokens[1:] else len(tokens)
+            # the token at position p was chosen at step p - 1
+            result.append(steps[row][prompt_length - 1 : end - 1])
+        return result
+
+
+def repeated_tail(tokens: list, max_ngram: int, max_repeats: int) -> bool:
+    # True when the sequence ends with the same n-gram `max_repeats` times in a row
+    for n in range(1, max_ngram + 1):
+        span = n * max_repeats
+        if len(tokens) < span:
+            break
+        tail = tokens[-n:]
+        if all(tokens[-span + k * n : -span + (k + 1) * n] == tail for k in range(max_repeats - 1)):
+            return True
+    return False
+
+
+class RepetitionStopper(LogitsProcessor):
+    # Forces end of text on sequences that have started looping, the usual
+    # failure of Whisper on noise or silence. Tokens before
+    # `prompt_length` (start token and decoder prompt) are not checked.
+
+    def __init__(self, eos_token_id: int, prompt_length: int, max_ngram: int = 8, max_repeats: int = 4):
+        self.eos_token_id = eos_token_id
+        self.prompt_length = prompt_length
+        self.max_ngram = max_ngram
+        self.max_repeats = max_repeats
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row, tokens in enumerate(input_ids[:, self.prompt_length :].tolist()):
+            # finished sequences are padded with end of text
+            if tokens and tokens[-1] == self.eos_token_id:
+                continue
+            if repeated_tail(tokens, self.max_ngram, self.max_repeats):
+                scores[row] = -math.inf
+                scores[row, self.eos_token_id] = 0
+        return scores
+
+
+def resolve_decoding(options: dict, duration: float) -> dict:
+    # Turns decoding options from the config into generate settings for
+    # audio of `duration` seconds: the token budget grows with the duration
+    # and never drops below `min_new_tokens`
+    if not options:
+        return {}
+    budget = None
+    if options.get("tokens_per_second"):
+        budget = max(options.get("min_new_tokens", 0), math.ceil(options["tokens_per_second"] * duration))
+    return {
+        "num_beams": options.get("num_beams", 1),
+        "max_new_tokens": budget,
+        "max_ngram": options.get("max_ngram", 0),
+        "max_repeats": options.get("max_repeats", 0),
+    }
+
+
+def new_token_limit(decoding: dict, prompt_length: int, max_length: int) -> int:
+    # `prompt_length` counts the start token and the forced decoder prompt;
+    # the budget covers the tokens after them and is capped at the model's limit
+    if not decoding.get("max_new_tokens"):
+        return None
+    return min(decoding["max_new_tokens"] + prompt_length - 1, max_length - 1)
+
+
+def generate_kwargs(
+    decoding: dict, eos_token_id: int, prompt_length: int, max_length: int, recorder: TokenLogprobRecorder = None
+) -> dict:
+    # `recorder` is only attached to greedy search, where the best processed
+    # score is the token that gets picked
+    kwargs = {}
+    processors = LogitsProcessorList()
+    if decoding.get("num_beams", 1) > 1:
+        kwargs["num_beams"] = decoding["num_beams"]
+    if decoding.get("max_new_tokens"):
+        kwargs["max_new_tokens"] = new_token_limit(decoding, prompt_length, max_length)
+    if decoding.get("max_ngram") and decoding.get("max_repeats"):
+        processors.append(
+            RepetitionStopper(eos_token_id, prompt_length, decoding["max_ngram"], decoding["max_repeats"])
+        )
+    if recorder is not None and decoding.get("num_beams", 1) == 1:
+        processors.append(recorder)
+    if processors:
+        kwargs["logits_processor"] = processors
+    return kwargs
+
+
+def record_sequences(sequences, decoding: dict, stats: list, eos_token_id: int, prompt_length: int, max_length: int):
+    # Adds the outcome of each generated sequence to its job's stats (one
+    # DecodingStats or None per row)
+    generate_limit = max_length - 1
+    budget = new_token_limit(decoding, prompt_length, max_length)
+    for sequence, row_stats in zip(sequences, stats):
+        tokens = sequence[1:].tolist() if isinstance(sequence, torch.Tensor) else list(sequence[1:])
+        finished = eos_token_id in tokens
+        if finished:
+            tokens = tokens[: tokens.index(eos_token_id)]
+        generated = tokens[prompt_length - 1 :]
+        repetition_stop = bool(decoding.get("max_ngram") and decoding.get("max_repeats")) and repeated_tail(
+            generated, decoding["max_ngram"], decoding["max_repeats"]
+        )
+        budget_stop = not finished and budget is not None and len(tokens) >= budget
+        tokens_saved = 0
+        if repetition_stop:
+            tokens_saved = generate_limit - len(tokens) - 1
+        elif budget_stop:
+            tokens_saved = generate_limit - budget
+        tokens_saved = max(0, tokens_saved)
+
+        if repetition_stop or budget_stop:
+            EARLY_STOPS.inc(reason="repetition" if repetition_stop else "budget")
+            TOKENS_SAVED.inc(tokens_saved)
+        if row_stats is not None:
+            row_stats.add(len(generated), repetition_stop, budget_stop, tokens_saved)
@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+import torch
+
+
+def split_audio(speech_array: np.ndarray, chunk_samples: int) -> np.ndarray:
+    # fixed-size chunks as rows of one array, the last one zero-padded
+    n_chunks = max(1, math.ceil(speech_array.shape[0] / chunk_samples))
+    chunks = np.zeros((n_chunks, chunk_samples), dtype=np.float32)
+    chunks.reshape(-1)[: speech_array.shape[0]] = speech_array
+    return chunks
+
+
+def log_mel_spectrogram(chunks: np.ndarray, feature_extractor) -> torch.Tensor:
+    # Batched equivalent of calling WhisperFeatureExtractor on every chunk.
+    # Each chunk would be zero-padded to a full 30 s window, and every STFT
+    # frame past the end of the audio has zero power, so only the frames
+    # that overlap real samples are computed and the rest are filled with
+    # the per-chunk floor value the extractor would have produced.
+    n_fft = feature_extractor.n_fft
+    hop_length = feature_extractor.hop_length
+    n_samples = feature_extractor.n_samples
+    n_frames = feature_extractor.nb_max_frames
+    mel_filters = torch.from_numpy(np.asarray(feature_extractor.mel_filters, dtype=np.float32))
+
+    n_chunks, chunk_samples = chunks.shape
+    if n_chunks == 0:
+        return torch.empty((0, mel_filters.shape[1], n_frames), dtype=torch.float32)
+    chunk_samples = min(chunk_samples, n_samples)
+    signal_samples = min(chunk_samples + n_fft, n_samples)
+
+    signal = torch.zeros((n_chunks, signal_samples), dtype=torch.float32)
+    signal[:, :chunk_samples] = torch.from_numpy(chunks[:, :chunk_samples])
+
+    stft = torch.stft(
+        signal,
+        n_fft,
+        hop_length,
+        window=torch.hann_window(n_fft),
+        center=True,
+        pad_mode="reflect",
+        return_complex=True,
+    )
+    active_frames = min(stft.shape[-1], n_frames)
+    power = stft[..., :active_frames].abs() ** 2
+
+    mel_spec = torch.matmul(mel_filters.T, power)
+    log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+
+    # padded frames are log10(1e-10) = -10 before normalisation
+    silence = torch.full((n_chunks, 1, 1), -10.0)
+    spec_max = torch.maximum(log_spec.amax(dim=(1, 2), keepdim=True), silence)
+    floor = spec_max - 8.0
+
+    features = torch.empty((n_chunks, mel_filters.shape[1], n_frames), dtype=torch.float32)
+    features[..., :active_frames] = torch.maximum(log_spec, floor)
+    features[..., active_frames:] = torch.maximum(silence, floor)
+    return (features + 4.0) / 4.0
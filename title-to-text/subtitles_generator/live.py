@@ -0,0 +1,251 @@
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from subtitles_generator.features import log_mel_spectrogram
+from subtitles_generator.decoding import resolve_decoding
+from subtitles_generator.metrics import LIVE_CUE_LATENCY_SECONDS, LIVE_DECODE_SECONDS
+from subtitles_generator.utils import Cue
+
+
+def normalize(text: str) -> str:
+    # hypotheses are compared without case and punctuation, which Whisper
+    # often revises once it hears how a sentence continues
+    return " ".join(re.sub(r"[^\w\s]", "", text.lower()).split())
+
+
+class LiveStats:
+    def __init__(self):
+        self.decodes = 0
+        self.decode_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.dropped_seconds = 0.0
+        self.latencies = []
+
+    def as_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "decodes": self.decodes,
+            "decode_s": round(self.decode_seconds, 3),
+            "audio_s": round(self.audio_seconds, 3),
+            "dropped_s": round(self.dropped_seconds, 3),
+            "real_time_factor": round(self.decode_seconds / self.audio_seconds, 3) if self.audio_seconds else None,
+            "cues": len(latencies),
+            "latency_p50_s": round(latencies[len(latencies) // 2], 3) if latencies else None,
+            "latency_max_s": round(latencies[-1], 3) if latencies else None,
+        }
+
+
+class LiveTranscriber:
+    # Sliding-window transcription of audio that arrives in small frames.
+    # Every `step_seconds` of new audio the uncommitted part of the stream
+    # (at most `window_seconds`) is decoded again with timestamp tokens.
+    # A segment is committed as a cue once two consecutive decodes agree on
+    # it, or earlier when waiting for the next decode would take it past
+    # `latency_seconds` after its audio arrived; the window then restarts
+    # at the end of the last cue. Everything after it is sent as a partial
+    # hypothesis that later decodes may still revise.
+    # A decode covers at most one window. When decoding falls behind, the
+    # oldest window is decoded and committed in full, and audio beyond
+    # two windows is dropped instead of queued.
+    # append() may be called from another thread than step() and finish().
+
+    def __init__(
+        self,
+        model,
+        lang: str = None,
+        sampling_rate: int = 16000,
+        step_seconds: float = 1.0,
+        window_seconds: float = 20.0,
+        latency_seconds: float = 3.0,
+        decoding_options: dict = None,
+    ):
+        window_limit = model.processor.feature_extractor.chunk_length
+        if not 0 < window_seconds <= window_limit:
+            raise ValueError(f"Window must be at most the model's {window_limit} s input, got {window_seconds}")
+        self.model = model
+        self.lang = lang
+        self.sampling_rate = sampling_rate
+        self.step_samples = int(step_seconds * sampling_rate)
+        self.window_samples = int(window_seconds * sampling_rate)
+        self.latency_seconds = latency_seconds
+        self.decoding = resolve_decoding(decoding_options, window_seconds)
+        self.stats = LiveStats()
+        self._lock = threading.Lock()
+        # samples from `_offset` (in samples since the stream started) on
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._offset = 0
+        self._decoded_until = 0
+        # (samples received so far, arrival time) per appended frame
+        self._arrivals = deque()
+        self._previous = []
+        self._cues = 0
+        self._last_decode = 0.0
+
+    @property
+    def received(self) -> int:
+        return self._offset + self._buffer.shape[0]
+
+    def append(self, samples: np.ndarray):
+        with self._lock:
+            self._buffer = np.concatenate([self._buffer, samples.astype(np.float32, copy=False)])
+            self._arrivals.append((self.received, time.perf_counter()))
+            self.stats.audio_seconds += samples.shape[0] / self.sampling_rate
+            overflow = self._buffer.shape[0] - 2 * self.window_samples
+            if overflow > 0:
+                self.stats.dropped_seconds += overflow / self.sampling_rate
+                self._trim(self._offset + overflow)
+
+    def ready(self) -> bool:
+        # enough new audio for another decode
+        return self.received - self._decoded_until >= self.step_samples
+
+    def step(self) -> list:
+        # Decodes the current window; returns the events to send: "cue"
+        # for every newly committed segment, then one "partial"
+        with self._lock:
+            end = self.received
+            buffer = self._buffer[: self.window_samples]
+            offset = self._offset
+        if end == self._decoded_until:
+            return []
+        self._decoded_until = end
+        window_end = offset + buffer.shape[0]
+        segments = self._decode(buffer, offset)
+        committed, pending = self._agree(segments, offset, window_end)
+        events = self._commit(committed, window_end)
+        self._previous = pending
+        events.append(self._partial(pending))
+        return events
+
+    def finish(self) -> list:
+        # end of the stream: whatever is left is committed as is, one
+        # window at a time
+        events = []
+        while True:
+            with self._lock:
+                end = self.received
+                buffer = self._buffer[: self.window_samples]
+                offset = self._offset
+            if end <= offset:
+                break
+            window_end = offset + buffer.shape[0]
+            segments = self._decode(buffer, offset)
+            cut = window_end / self.sampling_rate
+            events += self._commit(
+                [(start, cut if stop is None else stop, text) for start, stop, text in segments], window_end
+            )
+            if window_end == end:
+                break
+            with self._lock:
+                if self._offset == offset:
+                    # nothing committed in this window
+                    self._trim(window_end)
+        self._previous = []
+        return events
+
+    def _decode(self, buffer: np.ndarray, offset: int) -> list:
+        # (start, end, text) in seconds since the stream started; the last
+        # segment has no end while the speaker is mid-sentence
+        feature_extractor = self.model.processor.feature_extractor
+        window = np.zeros((1, feature_extractor.n_samples), dtype=np.float32)
+        window[0, : buffer.shape[0]] = buffer
+        start = time.perf_counter()
+        input_features = log_mel_spectrogram(window, feature_extractor)
+        segments = self.model.generate_segments(input_features, self.lang, self.decoding)[0]
+        self._last_decode = time.perf_counter() - start
+        self.stats.decodes += 1
+        self.stats.decode_seconds += self._last_decode
+        LIVE_DECODE_SECONDS.observe(self._last_decode)
+
+        window_start = offset / self.sampling_rate
+        window_end = (offset + buffer.shape[0]) / self.sampling_rate
+        result, floor = [], window_start
+        for segment_start, segment_end, text in segments:
+            segment_start = max(window_start + segment_start, floor)
+            if not text or segment_start >= window_end:
+                # timestamps past the audio come from the zero padding
+                continue
+            if segment_end is not None:
+                segment_end = min(window_start + segment_end, window_end)
+                # segments must not go back in time
+                if segment_end <= segment_start:
+                    continue
+                floor = segment_end
+            result.append((segment_start, segment_end, text))
+        return result
+
+    def _agree(self, segments: list, start: int, end: int):
+        # Splits off the leading segments that are final: finished segments
+        # that the previous decode produced too, or that would miss the
+        # latency target if they waited for the next decode. `start` and
+        # `end` are the samples the decoded window covered.
+        cut = end / self.sampling_rate
+        # when the next decode would be done
+        next_commit = time.perf_counter() + self.step_samples / self.sampling_rate + self._last_decode
+        previous = {normalize(text) for _, _, text in self._previous}
+        committed = []
+        for segment in segments:
+            _, stop, text = segment
+            if stop is None:
+                break
+            agreed = normalize(text) in previous
+            due = next_commit - self._arrival(int(stop * self.sampling_rate)) > self.latency_seconds
+            if not (agreed or due):
+                break
+            committed.append(segment)
+        pending = segments[len(committed) :]
+
+        # The window is full: everything decoded is committed, a sentence
+        # still running is cut at the end of the window. Without any speech
+        # the window is only trimmed.
+        if end - start >= self.window_samples and not committed:
+            committed = [(begin, cut if stop is None else stop, text) for begin, stop, text in pending]
+            pending = []
+            if not committed:
+                with self._lock:
+                    self._trim(end - self.step_samples)
+        return committed, pending
+
+    def _commit(self, segments: list, end: int) -> list:
+        events = []
+        now = time.perf_counter()
+        for start, stop, text in segments:
+            self._cues += 1
+            latency = now - self._arrival(int(stop * self.sampling_rate))
+            self.stats.latencies.append(latency)
+            LIVE_CUE_LATENCY_SECONDS.observe(latency)
+            cue = Cue(self._cues, start, stop, text.strip())
+            events.append({"type": "cue", **cue._asdict(), "latency_s": round(latency, 3)})
+        if segments:
+            with self._lock:
+                self._trim(min(int(segments[-1][1] * self.sampling_rate), end))
+        return events
+
+    def _partial(self, segments: list) -> dict:
+        start = segments[0][0] if segments else self._offset / self.sampling_rate
+        return {
+            "type": "partial",
+            "start": start,
+            "end": self.received / self.sampling_rate,
+            "text": " ".join(text.strip() for _, _, text in segments),
+        }
+
+    def _arrival(self, sample: int) -> float:
+        # when the frame holding `sample` arrived; append() may add frames meanwhile
+        with self._lock:
+            for received, arrived in self._arrivals:
+                if received > sample:
+                    return arrived
+            return self._arrivals[-1][1] if self._arrivals else time.perf_counter()
+
+    def _trim(self, sample: int):
+        # drops audio before `sample`; called with the lock held
+        sample = max(sample, self._offset)
+        self._buffer = self._buffer[sample - self._offset :]
+        self._offset = sample
+        while self._arrivals and self._arrivals[0][0] <= sample:
+            self._arrivals.popleft()
@@ -0,0 +1,181 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Minimal Prometheus-style metrics: counters, gauges and histograms kept in
+# process memory and rendered in the text exposition format by render().
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_metrics = []
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function=None):
+        super().__init__(name, documentation)
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def set_function(self, function):
+        # value computed at scrape time
+        self._function = function
+
+    def render(self) -> list:
+        if self._function is not None:
+            self.set(self._function())
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, observations = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, observations + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for labels, (counts, total, observations) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets + ("+Inf",), counts + [observations]):
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {observations}")
+        return lines
+
+
+def resident_memory_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+AUDIO_DECODE_SECONDS = Histogram(
+    "subtitles_audio_decode_seconds", "Time spent decoding media into PCM samples"
+)
+LANGUAGE_DETECTION_SECONDS = Histogram(
+    "subtitles_language_detection_seconds", "Time spent identifying the spoken language"
+)
+FEATURE_EXTRACTION_SECONDS = Histogram(
+    "subtitles_feature_extraction_seconds", "Time spent computing log-mel features per window"
+)
+GENERATE_BATCH_SECONDS = Histogram(
+    "subtitles_generate_batch_seconds", "Time spent in one model generate call"
+)
+GENERATE_BATCH_SIZE = Histogram(
+    "subtitles_generate_batch_size", "Number of chunks per generate call", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+SRT_WRITE_SECONDS = Histogram(
+    "subtitles_srt_write_seconds", "Time spent writing cues into a subtitles file"
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "subtitles_model_load_seconds", "Time spent loading a model into memory"
+)
+CHUNKS_TRANSCRIBED = Counter(
+    "subtitles_chunks_transcribed_total", "Chunks decoded by the model"
+)
+CHUNKS_SKIPPED = Counter(
+    "subtitles_chunks_skipped_total", "Chunks skipped as silence by the VAD"
+)
+EARLY_STOPS = Counter(
+    "subtitles_early_stops_total", "Sequences stopped by the repetition cut-off or the token budget"
+)
+TOKENS_SAVED = Counter(
+    "subtitles_tokens_saved_total", "Decode steps avoided compared to running to the length limit"
+)
+ASSISTED_DRAFTED_TOKENS = Counter(
+    "subtitles_assisted_drafted_tokens_total", "Tokens proposed by the draft model in assisted decoding"
+)
+ASSISTED_ACCEPTED_TOKENS = Counter(
+    "subtitles_assisted_accepted_tokens_total", "Draft tokens accepted by the verifying model"
+)
+PIPELINE_STAGE_SECONDS = Counter(
+    "subtitles_pipeline_stage_seconds_total",
+    "Time each transcription pipeline stage spent busy, starved for input or blocked on a full queue",
+)
+LIVE_DECODE_SECONDS = Histogram(
+    "subtitles_live_decode_seconds", "Time to decode one sliding window of a live stream"
+)
+LIVE_CUE_LATENCY_SECONDS = Histogram(
+    "subtitles_live_cue_latency_seconds", "Time from the arrival of a live cue's last audio to its commit"
+)
+RECORDED_FRAMES = Counter(
+    "subtitles_recorded_frames_total", "Browser recording frames written to disk or dropped, by track"
+)
+RESIDENT_MEMORY = Gauge(
+    "subtitles_resident_memory_bytes", "Resident memory of the process", resident_memory_bytes
+)
+LOADED_MODELS = Gauge("subtitles_loaded_models", "Models currently held by the model registry")
+JOBS_IN_FLIGHT = Gauge("subtitles_jobs_in_flight", "Subtitle jobs queued or running")
+JOBS_RUNNING = Gauge("subtitles_jobs_running", "Subtitle jobs currently running on a worker")
+BATCH_QUEUE_DEPTH = Gauge(
+    "subtitles_batch_queue_depth", "Chunks waiting in the cross-request batcher"
+)
+JOBS_FINISHED = Counter("subtitles_jobs_finished_total", "Finished subtitle jobs by final status")
@@ -0,0 +1,239 @@
+import os
+import queue
+import logging
+import threading
+import multiprocessing
+
+import numpy as np
+
+from subtitles_generator.audio import MediaSlice, count_samples
+
+
+def split_cores(n_workers: int) -> list:
+    # contiguous groups of the cores this process may run on, one per worker
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    return [group.tolist() for group in np.array_split(cores, n_workers) if len(group)]
+
+
+def _listen_for_cancels(controls, cancelled: set):
+    # runs on a thread of the worker while it transcribes a shard
+    while True:
+        job_id = controls.get()
+        if job_id is None:
+            return
+        cancelled.add(job_id)
+
+
+def _worker_main(worker_id, model_name, precision, threads, cores, tasks, controls, results):
+    # runs in a child process: pin, load a private model copy, serve shards
+    import torch
+
+    from subtitles_generator.core import Model
+
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads or len(cores) or 1)
+
+    model = Model(model_name, device="cpu", precision=precision)
+    cancelled = set()
+    threading.Thread(target=_listen_for_cancels, args=(controls, cancelled), daemon=True).start()
+    results.put(("ready", None, worker_id, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, first_chunk, source, options = task
+
+        def check_cancelled(done, total):
+            if job_id in cancelled:
+                raise InterruptedError("shard cancelled")
+
+        try:
+            # a MediaSlice is decoded window by window while it is transcribed
+            for index, text in model.transcribe_stream(source, progress_callback=check_cancelled, **options):
+                results.put(("chunk", job_id, first_chunk + index, text))
+        except InterruptedError:
+            pass
+        except Exception as e:
+            results.put(("error", job_id, worker_id, repr(e)))
+        cancelled.discard(job_id)
+        results.put(("done", job_id, worker_id, None))
+
+
+class ParallelTranscriber:
+    # A pool of worker processes, each holding its own copy of the model
+    # with its own intra-op thread count and (optionally) pinned cores.
+    # A job's chunks are split into one contiguous shard per worker and the
+    # results are merged back in chunk order. Concurrent jobs queue their
+    # shards behind each other on the workers; a dispatcher thread routes
+    # each result to the job it belongs to.
+
+    def __init__(
+        self,
+        model_name: str,
+        n_workers: int,
+        precision: str = "fp32",
+        threads_per_worker: int = None,
+        pin_cores: bool = True,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.n_workers = n_workers
+        self._results = context.Queue()
+        self._tasks = []
+        self._controls = []
+        self._processes = []
+        self._job_id = 0
+        self._jobs = {}
+        self._error = None
+        self._lock = threading.Lock()
+
+        core_groups = split_cores(n_workers) if pin_cores else [[]] * n_workers
+        for worker_id in range(n_workers):
+            cores = core_groups[worker_id % len(core_groups)]
+            tasks, controls = context.Queue(), context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(
+                    worker_id,
+                    model_name,
+                    precision,
+                    threads_per_worker,
+                    cores,
+                    tasks,
+                    controls,
+                    self._results,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._tasks.append(tasks)
+            self._controls.append(controls)
+            self._processes.append(process)
+
+        for _ in range(n_workers):
+            self._get_result()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="parallel-results", daemon=True)
+        self._dispatcher.start()
+        logging.info(f"Started {n_workers} transcription workers for {model_name}")
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._results.get(timeout=5)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self._processes):
+                    raise RuntimeError("A transcription worker exited unexpectedly")
+
+    def _dispatch(self):
+        try:
+            while True:
+                result = self._get_result()
+                if result is None:
+                    return
+                with self._lock:
+                    job = self._jobs.get(result[1])
+                if job is not None:
+                    job.put(result)
+        except RuntimeError as e:
+            self._error = e
+            with self._lock:
+                for job in self._jobs.values():
+                    job.put(("failed", None, None, str(e)))
+
+    def _job_result(self, job: queue.Queue):
+        result = job.get()
+        if result[0] == "failed":
+            raise RuntimeError(result[3])
+        return result
+
+    def transcribe_stream(
+        self,
+        audio,
+        chunk_size: int = 4,
+        sampling_rate: int = 16000,
+        lang: str = None,
+        batch_size: int = 4,
+        progress_callback=None,
+        vad_options: dict = None,
+        decoding_options: dict = None,
+        pipeline_options: dict = None,
+    ):
+        # same contract as Model.transcribe_stream: (chunk index, text) in order
+        chunk_samples = chunk_size * sampling_rate
+        n_samples = count_samples(audio, sampling_rate)
+        if n_samples is None:
+            raise ValueError(f"Cannot determine the duration of {audio} to shard it")
+        total = max(1, -(-n_samples // chunk_samples))
+        options = {
+            "chunk_size": chunk_size,
+            "sampling_rate": sampling_rate,
+            "lang": lang,
+            "batch_size": batch_size,
+            "vad_options": vad_options,
+            "decoding_options": decoding_options,
+            "pipeline_options": pipeline_options,
+        }
+
+        shards = [s for s in np.array_split(np.arange(total), self.n_workers) if len(s)]
+        with self._lock:
+            # held only while submitting, so every worker sees the shards of
+            # concurrent jobs in the same order
+            if self._error is not None:
+                raise self._error
+            self._job_id += 1
+            job_id = self._job_id
+            job = self._jobs[job_id] = queue.Queue()
+            for worker_id, shard in enumerate(shards):
+                first, last = int(shard[0]), int(shard[-1]) + 1
+                if isinstance(audio, np.ndarray):
+                    source = audio[first * chunk_samples : last * chunk_samples]
+                else:
+                    # the last shard runs to the end of the file, however long the probe said it is
+                    duration = (last - first) * chunk_size if worker_id < len(shards) - 1 else None
+                    source = MediaSlice(audio, first * chunk_size, duration)
+                self._tasks[worker_id].put((job_id, first, source, options))
+
+        pending = {}
+        next_index = 0
+        running = set(range(len(shards)))
+        try:
+            while running:
+                kind, _, index, payload = self._job_result(job)
+                if kind == "error":
+                    raise RuntimeError(f"Worker {index} failed: {payload}")
+                if kind == "done":
+                    running.discard(index)
+                    continue
+                pending[index] = payload
+                while next_index in pending:
+                    if progress_callback is not None:
+                        progress_callback(next_index + 1, max(total, next_index + 1))
+                    yield next_index, pending.pop(next_index)
+                    next_index += 1
+            for index in sorted(pending):
+                yield index, pending[index]
+        finally:
+            if running and self._error is None:
+                # stop this job's other shards and wait until they are finished
+                for worker_id in running:
+                    self._controls[worker_id].put(job_id)
+                while running:
+                    kind, _, index, _ = self._job_result(job)
+                    if kind == "done":
+                        running.discard(index)
+            with self._lock:
+                del self._jobs[job_id]
+
+    def close(self):
+        for tasks, controls in zip(self._tasks, self._controls):
+            tasks.put(None)
+            controls.put(None)
+        self._results.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
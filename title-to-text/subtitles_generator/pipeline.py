@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from subtitles_generator.metrics import PIPELINE_STAGE_SECONDS
+
+_END = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class StageStats:
+    # busy: time spent doing the stage's work, starved: waiting for the
+    # previous stage, blocked: waiting for room in the next stage's queue
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "items": self.items,
+            "busy_s": round(self.busy, 3),
+            "starved_s": round(self.starved, 3),
+            "blocked_s": round(self.blocked, 3),
+        }
+
+
+class PipelineStats:
+    # Per-stage timings, summed over every pipeline run of a job
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> StageStats:
+        with self._lock:
+            return self.stages.setdefault(name, StageStats(name))
+
+    def add(self, name: str, state: str, seconds: float):
+        stage = self.stage(name)
+        with self._lock:
+            setattr(stage, state, getattr(stage, state) + seconds)
+        PIPELINE_STAGE_SECONDS.inc(seconds, stage=name, state=state)
+
+    def count(self, name: str):
+        stage = self.stage(name)
+        with self._lock:
+            stage.items += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {name: stage.as_dict() for name, stage in self.stages.items()}
+
+
+class Pipeline:
+    # Producer/consumer pipeline: the (name, iterable, queue depth) `source`
+    # is iterated on one thread and each (name, function, queue depth) stage
+    # runs on its own thread, connected by bounded queues, so each stage
+    # works at most `depth` items ahead of the next. Iterating the pipeline
+    # yields the results of the last stage in order; the time the consumer
+    # spends between items is counted as the busy time of `consumer`.
+    # Errors are re-raised in the consumer and closing the iterator stops
+    # the threads. With `threaded=False` everything runs inline on the
+    # consumer's thread.
+
+    def __init__(
+        self, source: tuple, stages: list, consumer: str, stats: PipelineStats = None, threaded: bool = True
+    ):
+        self.source = source
+        self.stages = stages
+        self.consumer = consumer
+        self.stats = stats or PipelineStats()
+        self.threaded = threaded
+        self._stop = threading.Event()
+
+    def __iter__(self):
+        if not self.threaded:
+            return self._run_inline()
+        return self._run_threaded()
+
+    def _timed(self, name: str, state: str, start: float):
+        self.stats.add(name, state, time.perf_counter() - start)
+
+    def _run_inline(self):
+        source_name, source, _ = self.source
+        iterator = iter(source)
+        try:
+            while True:
+                start = time.perf_counter()
+                item = next(iterator, _END)
+                if item is _END:
+                    return
+                self._timed(source_name, "busy", start)
+                self.stats.count(source_name)
+                for name, function, _ in self.stages:
+                    start = time.perf_counter()
+                    item = function(item)
+                    self._timed(name, "busy", start)
+                    self.stats.count(name)
+                start = time.perf_counter()
+                yield item
+                self._timed(self.consumer, "busy", start)
+                self.stats.count(self.consumer)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def _put(self, name: str, output: queue.Queue, item) -> bool:
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    output.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self._timed(name, "blocked", start)
+
+    def _get(self, name: str, source: queue.Queue):
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+        finally:
+            self._timed(name, "starved", start)
+
+    def _produce(self, name: str, source, output: queue.Queue):
+        iterator = iter(source)
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator, _END)
+                except Exception as e:
+                    item = _Failure(e)
+                self._timed(name, "busy", start)
+                if item is _END or isinstance(item, _Failure):
+                    self._put(name, output, item)
+                    return
+                self.stats.count(name)
+                if not self._put(name, output, item):
+                    return
+        finally:
+            # ends e.g. an ffmpeg process still feeding the source
+            if hasattr(iterator, "close"):
+                iterator.close()
+
+    def _transform(self, name: str, function, source: queue.Queue, output: queue.Queue):
+        while True:
+            item = self._get(name, source)
+            if item is not _END and not isinstance(item, _Failure):
+                start = time.perf_counter()
+                try:
+                    item = function(item)
+                    self.stats.count(name)
+                except Exception as e:
+                    item = _Failure(e)
+                self._timed(name, "busy", start)
+            if not self._put(name, output, item) or item is _END or isinstance(item, _Failure):
+                return
+
+    def _run_threaded(self):
+        source_name, source, depth = self.source
+        queues = [queue.Queue(maxsize=max(1, depth))]
+        threads = [
+            threading.Thread(
+                target=self._produce,
+                args=(source_name, source, queues[0]),
+                name=f"pipeline-{source_name}",
+                daemon=True,
+            )
+        ]
+        for name, function, depth in self.stages:
+            queues.append(queue.Queue(maxsize=max(1, depth)))
+            threads.append(
+                threading.Thread(
+                    target=self._transform,
+                    args=(name, function, queues[-2], queues[-1]),
+                    name=f"pipeline-{name}",
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(self.consumer, queues[-1])
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                start = time.perf_counter()
+                yield item
+                self._timed(self.consumer, "busy", start)
+                self.stats.count(self.consumer)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
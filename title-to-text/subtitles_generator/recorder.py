@@ -0,0 +1,249 @@
+import logging
+import pathlib
+import queue
+import itertools
+import threading
+import time
+from fractions import Fraction
+
+import av
+
+from subtitles_generator.metrics import RECORDED_FRAMES
+
+_END = object()
+
+# Audio timestamps follow the samples written; when arrival times run ahead
+# by more than this (dropped frames, a stalled track) the gap is filled with
+# silence, so the audio stays in sync with the video
+MAX_AUDIO_DRIFT = 0.2
+
+
+class RecorderStats:
+    def __init__(self):
+        self.video_frames = 0
+        self.audio_frames = 0
+        self.dropped_video = 0
+        self.dropped_audio = 0
+        self.max_queue_depth = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "video_frames": self.video_frames,
+            "audio_frames": self.audio_frames,
+            "dropped_video": self.dropped_video,
+            "dropped_audio": self.dropped_audio,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class StreamingRecorder:
+    # Encodes WebRTC video and audio frames into one file while they arrive.
+    # The frame callbacks only put frames on a bounded queue; a writer
+    # thread owns the container and encodes them, so memory stays bounded by
+    # `queue_size` frames and stopping only flushes the encoders. When the
+    # writer falls behind, new frames are dropped and counted instead of
+    # queued. Timestamps come from arrival times, so the output keeps the
+    # real duration however many frames were dropped.
+
+    def __init__(
+        self,
+        path,
+        queue_size: int = 64,
+        video_codec: str = "libx264",
+        video_options: dict = None,
+        audio_codec: str = "aac",
+        audio_rate: int = 48000,
+        frame_rate: int = 30,
+        tracks: tuple = ("video", "audio"),
+    ):
+        self.path = pathlib.Path(path)
+        self.tracks = tuple(tracks)
+        self.queue_size = queue_size
+        self.video_codec = video_codec
+        self.video_options = dict(video_options or {})
+        self.audio_codec = audio_codec
+        self.audio_rate = audio_rate
+        self.frame_rate = frame_rate
+        self.stats = RecorderStats()
+        self.error = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._video_slots = max(1, queue_size * 3 // 4)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_time = None
+        self._stopped = False
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    def add_video(self, frame: av.VideoFrame):
+        self._submit("video", frame)
+
+    def add_audio(self, frame: av.AudioFrame):
+        self._submit("audio", frame)
+
+    def _submit(self, kind: str, frame):
+        # called from the WebRTC tracks; never blocks
+        with self._lock:
+            if self._stopped:
+                return
+            if self._thread is None:
+                self._start_time = time.perf_counter()
+                self._thread = threading.Thread(target=self._write, name="recorder", daemon=True)
+                self._thread.start()
+        # video may only fill part of the queue, so a slow video encoder
+        # drops video frames before any audio is lost
+        if kind == "video" and self._queue.qsize() >= self._video_slots:
+            self._count_dropped(kind)
+            return
+        try:
+            self._queue.put_nowait((kind, time.perf_counter() - self._start_time, frame))
+        except queue.Full:
+            self._count_dropped(kind)
+            return
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self._queue.qsize())
+
+    def stop(self) -> pathlib.Path:
+        # Flushes and closes the file; returns its path, or None when
+        # nothing was recorded or writing failed. Safe to call more than once.
+        with self._lock:
+            already_stopped = self._stopped
+            self._stopped = True
+        if self._thread is None:
+            return None
+        if not already_stopped:
+            self._queue.put(_END)
+        self._thread.join()
+        if self.error is not None:
+            return None
+        return self.path
+
+    def _count_dropped(self, kind: str):
+        dropped = "dropped_video" if kind == "video" else "dropped_audio"
+        with self._lock:
+            setattr(self.stats, dropped, getattr(self.stats, dropped) + 1)
+        RECORDED_FRAMES.inc(kind=kind, status="dropped")
+
+    def _first_frames(self):
+        # A container's streams are fixed once writing starts, so the first
+        # frames are held back until every expected track has sent one, or a
+        # queue's worth arrived without it. Returns them and whether stop()
+        # was already called.
+        pending = []
+        while len(pending) < self.queue_size and not set(self.tracks) <= {kind for kind, _, _ in pending}:
+            item = self._queue.get()
+            if item is _END:
+                return pending, True
+            pending.append(item)
+        return pending, False
+
+    def _write(self):
+        container = None
+        try:
+            first, ended = self._first_frames()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            container = av.open(str(self.path), mode="w")
+            tracks = {}
+            for kind, _, frame in first:
+                if kind not in tracks:
+                    tracks[kind] = TRACK_TYPES[kind](self, container, frame)
+            rest = () if ended else iter(self._queue.get, _END)
+            for kind, arrival, frame in itertools.chain(first, rest):
+                if self.error is not None:
+                    # keep draining so the tracks see room in the queue
+                    continue
+                if kind not in tracks:
+                    # the track started too late to get a stream
+                    self._count_dropped(kind)
+                    continue
+                try:
+                    tracks[kind].encode(frame, arrival)
+                except Exception as e:
+                    logging.error(f"Recording to {self.path} failed: {e}")
+                    self.error = e
+            if self.error is None:
+                for track in tracks.values():
+                    track.flush()
+        except Exception as e:
+            logging.error(f"Recording to {self.path} failed: {e}")
+            self.error = e
+        finally:
+            if container is not None:
+                container.close()
+        logging.info(f"Recorded {self.path}: {self.stats.as_dict()}")
+
+
+class _VideoTrack:
+    # The size is taken from the first frame; later frames are scaled to it
+    # if the sender changes resolution mid-call
+
+    def __init__(self, recorder: StreamingRecorder, container, first_frame: av.VideoFrame):
+        self.recorder = recorder
+        self.container = container
+        self.stream = container.add_stream(recorder.video_codec, rate=recorder.frame_rate)
+        self.stream.width, self.stream.height = first_frame.width, first_frame.height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.options = recorder.video_options
+        self.stream.codec_context.time_base = Fraction(1, 1000)
+        self.last_pts = -1
+
+    def encode(self, frame: av.VideoFrame, arrival: float):
+        pts = int(arrival * 1000)
+        if pts <= self.last_pts:
+            # two frames within a millisecond; the encoder needs increasing timestamps
+            self.recorder._count_dropped("video")
+            return
+        frame = frame.reformat(width=self.stream.width, height=self.stream.height, format="yuv420p")
+        frame.pts, frame.time_base = pts, Fraction(1, 1000)
+        self.last_pts = pts
+        self.container.mux(self.stream.encode(frame))
+        self.recorder.stats.video_frames += 1
+        RECORDED_FRAMES.inc(kind="video", status="written")
+
+    def flush(self):
+        self.container.mux(self.stream.encode(None))
+
+
+class _AudioTrack:
+    # Mono at `audio_rate`, which is all transcription needs
+
+    def __init__(self, recorder: StreamingRecorder, container, first_frame: av.AudioFrame):
+        self.recorder = recorder
+        self.container = container
+        self.rate = recorder.audio_rate
+        self.stream = container.add_stream(recorder.audio_codec, rate=self.rate)
+        self.stream.layout = "mono"
+        self.resampler = av.AudioResampler(format=self.stream.format.name, layout="mono", rate=self.rate)
+        self.next_pts = 0
+
+    def encode(self, frame: av.AudioFrame, arrival: float):
+        # `arrival` is roughly when the frame's last sample was captured
+        start = int((arrival - frame.samples / frame.sample_rate) * self.rate)
+        if start - self.next_pts > MAX_AUDIO_DRIFT * self.rate:
+            silence = av.AudioFrame(format=self.stream.format.name, layout="mono", samples=start - self.next_pts)
+            silence.sample_rate = self.rate
+            for plane in silence.planes:
+                plane.update(bytes(plane.buffer_size))
+            self._encode(silence)
+        for resampled in self.resampler.resample(frame):
+            self._encode(resampled)
+        self.recorder.stats.audio_frames += 1
+        RECORDED_FRAMES.inc(kind="audio", status="written")
+
+    def _encode(self, frame: av.AudioFrame):
+        frame.pts, frame.time_base = self.next_pts, Fraction(1, self.rate)
+        self.next_pts += frame.samples
+        self.container.mux(self.stream.encode(frame))
+
+    def flush(self):
+        for resampled in self.resampler.resample(None):
+            self._encode(resampled)
+        self.container.mux(self.stream.encode(None))
+
+
+TRACK_TYPES = {"video": _VideoTrack, "audio": _AudioTrack}
@@ -0,0 +1,72 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from subtitles_generator.core import Model, default_device
+from subtitles_generator.metrics import MODEL_LOAD_SECONDS
+
+
+class ModelRegistry:
+    # Process-wide cache of loaded Whisper models keyed by
+    # (model name, device, precision, optimize). Least recently used models are
+    # dropped once the summed weight size goes over `max_memory_bytes`;
+    # the most recently requested model is always kept.
+
+    def __init__(self, max_memory_bytes: int = None):
+        self.max_memory_bytes = max_memory_bytes
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, model_name: str, device: str = None, precision: str = "fp32", optimize: bool = False
+    ) -> Model:
+        key = (model_name, device or default_device(), precision, optimize)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            # one lock per key so a slow load does not block lookups of other models
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+
+            try:
+                logging.info(f"Loading model {key} ...")
+                with MODEL_LOAD_SECONDS.time(model=model_name, precision=precision):
+                    model = Model(model_name, device=key[1], precision=precision, optimize=optimize)
+
+                with self._lock:
+                    self._models[key] = model
+                    self._evict()
+                return model
+            finally:
+                # also after a failed load; threads waiting on key_lock try again
+                with self._lock:
+                    self._loading.pop(key, None)
+
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(model.memory_footprint() for model in self._models.values())
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self._models.keys())
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def _evict(self):
+        if self.max_memory_bytes is None:
+            return
+        usage = sum(model.memory_footprint() for model in self._models.values())
+        while usage > self.max_memory_bytes and len(self._models) > 1:
+            key, model = self._models.popitem(last=False)
+            usage -= model.memory_footprint()
+            logging.info(f"Evicted model {key} from registry")
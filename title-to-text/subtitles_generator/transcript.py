@@ -0,0 +1,208 @@
+import gzip
+import json
+import pathlib
+import time
+
+from subtitles_generator.utils import Cue, format_timestamp
+
+# Model-independent record of one transcription: timed segments with their
+# full text, per-token log probabilities when the decoder reported them, and
+# the settings that produced them. Subtitles in any format or layout are
+# rendered from it without running the model again.
+
+TRANSCRIPT_VERSION = 1
+TRANSCRIPT_SUFFIX = ".transcript.json.gz"
+FORMATS = ("srt", "vtt", "json")
+
+
+class Segment:
+    __slots__ = ("start", "end", "text", "token_logprobs")
+
+    def __init__(self, start: float, end: float, text: str, token_logprobs: list = None):
+        self.start = start
+        self.end = end
+        self.text = text
+        self.token_logprobs = token_logprobs
+
+    @property
+    def avg_logprob(self) -> float:
+        if not self.token_logprobs:
+            return None
+        return sum(self.token_logprobs) / len(self.token_logprobs)
+
+    def as_list(self) -> list:
+        # positional to keep long transcripts small
+        return [self.start, self.end, self.text, self.token_logprobs]
+
+
+class Transcript:
+    def __init__(self, metadata: dict = None, segments: list = None):
+        self.metadata = metadata or {}
+        self.segments = segments or []
+
+    def add(self, start: float, end: float, text: str, token_logprobs: list = None):
+        if token_logprobs is not None:
+            token_logprobs = [round(logprob, 4) for logprob in token_logprobs]
+        self.segments.append(Segment(start, end, text, token_logprobs))
+
+    def as_dict(self) -> dict:
+        return {
+            "version": TRANSCRIPT_VERSION,
+            "metadata": self.metadata,
+            "segments": [segment.as_list() for segment in self.segments],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Transcript":
+        if data.get("version") != TRANSCRIPT_VERSION:
+            raise ValueError(f"Unsupported transcript version {data.get('version')}")
+        return cls(data["metadata"], [Segment(*segment) for segment in data["segments"]])
+
+    def save(self, path) -> pathlib.Path:
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(self.as_dict(), f, ensure_ascii=False, separators=(",", ":"))
+        tmp_path.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path) -> "Transcript":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+def transcript_path(subtitles_path) -> pathlib.Path:
+    # stored next to the subtitles it was written with, e.g. talk.transcript.json.gz
+    subtitles_path = pathlib.Path(subtitles_path)
+    return subtitles_path.with_name(subtitles_path.stem + TRANSCRIPT_SUFFIX)
+
+
+def new_transcript(**metadata) -> Transcript:
+    return Transcript({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **metadata})
+
+
+def record_chunks(indexed_texts, transcript: Transcript, interval_size: float):
+    # passes (chunk index, text) pairs through, adding each text to `transcript`
+    for i, text in indexed_texts:
+        if text is not None:
+            transcript.add(i * interval_size, (i + 1) * interval_size, text, getattr(text, "token_logprobs", None))
+        yield i, text
+
+
+def record_segments(segments, transcript: Transcript):
+    # passes (start, end, text) segments through, adding each to `transcript`
+    for start, end, text in segments:
+        transcript.add(start, end, text, getattr(text, "token_logprobs", None))
+        yield start, end, text
+
+
+def split_segment(segment: Segment, max_chars: int) -> list:
+    # Splits at word boundaries into pieces of at most `max_chars`
+    # characters (a single longer word stays whole); time is shared out in
+    # proportion to the characters of each piece
+    words = segment.text.split()
+    pieces, current = [], ""
+    for word in words:
+        candidate = f"{current} {word}" if current else word
+        if current and len(candidate) > max_chars:
+            pieces.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    if len(pieces) <= 1:
+        return [(segment.start, segment.end, segment.text.strip())]
+
+    total = sum(len(piece) for piece in pieces)
+    duration = segment.end - segment.start
+    result, start = [], segment.start
+    for i, piece in enumerate(pieces):
+        end = segment.end if i == len(pieces) - 1 else start + duration * len(piece) / total
+        result.append((start, end, piece))
+        start = end
+    return result
+
+
+def render_cues(
+    transcript: Transcript,
+    max_chars: int = None,
+    max_duration: float = None,
+    max_gap: float = 0.0,
+    min_avg_logprob: float = None,
+) -> list:
+    # Cues for any layout of the same transcript. Segments longer than
+    # `max_chars` are split; with `max_duration` neighbouring segments less
+    # than `max_gap` seconds apart are merged while the cue stays within
+    # both limits. Segments whose average token log probability is below
+    # `min_avg_logprob` are left out.
+    pieces = []
+    for segment in transcript.segments:
+        if min_avg_logprob is not None and segment.avg_logprob is not None:
+            if segment.avg_logprob < min_avg_logprob:
+                continue
+        if segment.end is None or not segment.text.strip():
+            continue
+        if max_chars:
+            pieces.extend(split_segment(segment, max_chars))
+        else:
+            pieces.append((segment.start, segment.end, segment.text.strip()))
+
+    merged = []
+    for start, end, text in pieces:
+        if max_duration and merged:
+            last_start, last_end, last_text = merged[-1]
+            joined = f"{last_text} {text}"
+            if (
+                start - last_end <= max_gap
+                and end - last_start <= max_duration
+                and (not max_chars or len(joined) <= max_chars)
+            ):
+                merged[-1] = (last_start, end, joined)
+                continue
+        merged.append((start, end, text))
+    return [Cue(index, start, end, text) for index, (start, end, text) in enumerate(merged, 1)]
+
+
+def render_srt(cues: list) -> str:
+    return "".join(
+        f"{cue.index}\n{format_timestamp(cue.start)} -->  {format_timestamp(cue.end)}\n{cue.text}\n\n"
+        for cue in cues
+    )
+
+
+def render_vtt(cues: list) -> str:
+    # WebVTT uses a dot before the milliseconds
+    lines = ["WEBVTT", ""]
+    for cue in cues:
+        start, end = format_timestamp(cue.start).replace(",", "."), format_timestamp(cue.end).replace(",", ".")
+        lines += [str(cue.index), f"{start} --> {end}", cue.text, ""]
+    return "\n".join(lines) + "\n"
+
+
+def render_json(cues: list, transcript: Transcript) -> str:
+    return json.dumps(
+        {
+            "metadata": transcript.metadata,
+            "cues": [
+                {"index": cue.index, "start": round(cue.start, 3), "end": round(cue.end, 3), "text": cue.text}
+                for cue in cues
+            ],
+        },
+        ensure_ascii=False,
+    )
+
+
+def render(transcript: Transcript, format: str = "srt", **layout) -> str:
+    # `layout` takes the options of render_cues
+    if format not in FORMATS:
+        raise ValueError(f"Format {format} is not supported. Supported formats are {list(FORMATS)}")
+    cues = render_cues(transcript, **layout)
+    if format == "vtt":
+        return render_vtt(cues)
+    if format == "json":
+        return render_json(cues, transcript)
+    return render_srt(cues)
+
@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import time
+import uuid
+
+import numpy as np
+from multipart.multipart import MultipartParser, parse_options_header
+
+from subtitles_generator.audio import decode_audio, ffmpeg_decode_command
+
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StreamingUpload:
+    # One uploaded media file, written to `directory/<upload id>/` as its
+    # bytes arrive. The same bytes are piped into ffmpeg, which writes mono
+    # float32 samples to audio.f32, so decoding is done shortly after the
+    # last byte arrives. Containers that need seeking (e.g. mp4 with the
+    # index at the end) cannot be decoded from a pipe; those are decoded
+    # from the stored file once the upload is complete.
+
+    def __init__(self, directory, filename: str, sampling_rate: int = 16000, max_bytes: int = None):
+        self.id = uuid.uuid4().hex
+        self.directory = pathlib.Path(directory) / self.id
+        self.directory.mkdir(parents=True)
+        self.filename = filename
+        # only the extension of the client's name is used on disk
+        self.media_path = self.directory / ("media" + pathlib.Path(filename).suffix.lower())
+        self.audio_path = self.directory / "audio.f32"
+        self.sampling_rate = sampling_rate
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._file = open(self.media_path, "wb")
+        self._stderr = open(self.directory / "ffmpeg.log", "wb")
+        self._decoder = None
+        try:
+            self._decoder = subprocess.Popen(
+                ffmpeg_decode_command("pipe:0", sampling_rate, output=self.audio_path),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=self._stderr,
+            )
+        except Exception:
+            self.abort()
+            raise
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(f"Upload is larger than {self.max_bytes} bytes")
+        self._file.write(data)
+        if self._decoder is not None:
+            try:
+                self._decoder.stdin.write(data)
+            except BrokenPipeError:
+                # ffmpeg gave up on the stream; decoded from the file at the end
+                self._decoder = self._stop_decoder()
+
+    def _stop_decoder(self):
+        try:
+            self._decoder.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._decoder.wait()
+        return None
+
+    def finish(self) -> dict:
+        self._file.close()
+        streamed = False
+        if self._decoder is not None:
+            decoder = self._decoder
+            self._decoder = self._stop_decoder()
+            streamed = decoder.returncode == 0
+        self._stderr.close()
+        if not streamed:
+            logging.info(f"Upload {self.id} could not be decoded while streaming, decoding the stored file")
+            samples = decode_audio(self.media_path, self.sampling_rate)
+            samples.tofile(self.audio_path)
+        info = {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "media_path": str(self.media_path),
+            "audio_path": str(self.audio_path),
+            "size": self.size,
+            "sampling_rate": self.sampling_rate,
+            "samples": self.audio_path.stat().st_size // np.dtype(np.float32).itemsize,
+            "decoded_while_streaming": streamed,
+        }
+        with open(self.directory / "upload.json", "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        return info
+
+    def abort(self):
+        self._file.close()
+        if self._decoder is not None:
+            self._decoder.kill()
+            self._decoder = self._stop_decoder()
+        self._stderr.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MultipartUploadParser:
+    # Push parser for a multipart/form-data body: feed it the raw body in
+    # chunks of any size and the part named `field` is streamed into a
+    # StreamingUpload without buffering the whole body. `new_upload` is
+    # called with the part's filename once its headers have been read.
+
+    def __init__(self, content_type: str, new_upload, field: str = "file"):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Expected a multipart/form-data body with a boundary")
+        self.field = field
+        self.new_upload = new_upload
+        self.upload = None
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._target = None
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    def write(self, data: bytes):
+        self._parser.write(data)
+
+    def finish(self):
+        self._parser.finalize()
+        if self.upload is None:
+            raise ValueError(f"The request has no '{self.field}' file part")
+        return self.upload
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._target = None
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if params.get(b"name", b"").decode() == self.field and self.upload is None:
+            filename = params.get(b"filename", b"upload").decode(errors="replace")
+            self.upload = self.new_upload(filename)
+            self._target = self.upload
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        # other form fields are ignored
+        if self._target is not None:
+            self._target.write(data[start:end])
+
+    def _on_part_end(self):
+        self._target = None
+
+
+def load_upload(directory, upload_id: str) -> dict:
+    # metadata of a finished upload; ids are checked so they cannot point outside `directory`
+    if not UPLOAD_ID_PATTERN.match(upload_id or ""):
+        raise ValueError(f"Invalid upload id {upload_id}")
+    path = pathlib.Path(directory) / upload_id / "upload.json"
+    if not path.is_file():
+        raise FileNotFoundError(f"Upload {upload_id} does not exist")
+    with open(path, encoding="utf-8") as f:
+        info = json.load(f)
+    # mtime doubles as the last-use time for prune_uploads
+    os.utime(path)
+    return info
+
+
+def _upload_usage(path: pathlib.Path):
+    # (last use, bytes) of one upload directory: its newest file, since jobs
+    # write their subtitles next to the media while they run
+    last_used, size = path.stat().st_mtime, 0
+    for entry in path.iterdir():
+        stat = entry.stat()
+        last_used, size = max(last_used, stat.st_mtime), size + stat.st_size
+    return last_used, size
+
+
+def prune_uploads(directory, max_bytes: int = None, max_age: float = None, keep: str = None) -> list:
+    # Removes uploads unused for `max_age` seconds, then the least recently
+    # used ones until all of them fit in `max_bytes`. An upload that is
+    # still streaming was used moments ago, so it is removed last.
+    # `keep` (the upload just stored) is never removed. Returns removed ids.
+    directory = pathlib.Path(directory)
+    if not directory.is_dir():
+        return []
+    uploads = []
+    for path in directory.iterdir():
+        if not UPLOAD_ID_PATTERN.match(path.name) or path.name == keep:
+            continue
+        try:
+            uploads.append((*_upload_usage(path), path))
+        except FileNotFoundError:
+            # removed meanwhile by another request
+            continue
+    uploads.sort()
+    total = sum(size for _, size, _ in uploads)
+    if keep is not None and (directory / keep).is_dir():
+        total += _upload_usage(directory / keep)[1]
+    now = time.time()
+    removed = []
+    for last_used, size, path in uploads:
+        expired = max_age is not None and now - last_used > max_age
+        if not expired and (max_bytes is None or total <= max_bytes):
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(path.name)
+        logging.info(f"Removed upload {path.name}")
+    return removed
+
+
+def upload_audio(info: dict) -> np.ndarray:
+    # decoded samples mapped from disk, so jobs only page in the windows they read
+    if not info["samples"]:
+        return np.zeros(0, dtype=np.float32)
+    return np.memmap(info["audio_path"], dtype=np.float32, mode="r")
@@ -5,13 +5,11 @@ os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 os.environ["XDG_RUNTIME_DIR"] = "/tmp/runtime-root"
 import logging
 
-import datetime
+import collections
 import pathlib
+import time
 
-import imageio
-
-imageio.plugins.ffmpeg.download()
-from moviepy.editor import VideoFileClip
+from subtitles_generator.metrics import SRT_WRITE_SECONDS
 
 # Configure logging
 logging.basicConfig(
@@ -25,36 +23,94 @@ def extract_audio(input_path: pathlib.Path) -> str:
     if input_path.suffix == ".wav":
         return str(input_path)
 
+    import imageio
+
+    imageio.plugins.ffmpeg.download()
+    from moviepy.editor import VideoFileClip
+
     video = VideoFileClip(str(input_path))
     audio_path = input_path.with_suffix(".wav")
     video.audio.write_audiofile(str(audio_path), verbose=False)
     return str(audio_path)
 
 
+Cue = collections.namedtuple("Cue", ["index", "start", "end", "text"])
+
+
+def format_timestamp(seconds: float) -> str:
+    # SRT time, HH:MM:SS,mmm
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def to_cues(indexed_texts, interval_size: int):
+    # turns (chunk index, text) pairs into numbered cues of `interval_size` seconds
+    frame_counter = 0
+    for i, text in indexed_texts:
+        # if text is None than we need to make a gap in subtitles flow
+        if text is None:
+            continue
+        # if the text too long for a frame
+        text = text[:250]
+
+        frame_counter += 1
+        yield Cue(frame_counter, i * interval_size, (i + 1) * interval_size, text)
+
+
+def segments_to_cues(segments):
+    # turns (start, end, text) segments with real times into numbered cues
+    for frame_counter, (start, end, text) in enumerate(segments, 1):
+        yield Cue(frame_counter, start, end, text[:250])
+
+
+class SrtWriter:
+    # writes cues one by one so the file can be read while it is generated
+
+    def __init__(self, subtitles_path: pathlib.Path):
+        subtitles_path.parent.mkdir(parents=True, exist_ok=True)
+        self.frame_counter = 0
+        self.write_seconds = 0.0
+        self._file = open(subtitles_path, "w", encoding="utf-8")
+
+    def write(self, cue: Cue):
+        start = time.perf_counter()
+        start_time = format_timestamp(cue.start)
+        end_time = format_timestamp(cue.end)
+        self._file.write(f"{cue.index}\n{start_time} -->  {end_time}\n{cue.text}\n\n")
+        self._file.flush()
+        self.frame_counter += 1
+        self.write_seconds += time.perf_counter() - start
+
+    def close(self):
+        self._file.close()
+        SRT_WRITE_SECONDS.observe(self.write_seconds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def create_srt(
     subtitles_path: pathlib.Path,
-    texts: list[str],
-    interval_size: int,
+    texts: list,
+    interval_size: int = None,
 ):
+    # `texts` are either one string per `interval_size` seconds chunk or,
+    # without an interval, (start, end, text) segments from long-form mode
     if subtitles_path.suffix != ".srt":
         subtitles_path.rename(subtitles_path.with_suffix(".srt"))
 
-    with open(subtitles_path, "w", encoding="utf-8") as f:
-        timer = 0
-        frame_counter = 0
-        for text in texts:
-            # if text is None than we need to make a gap in subtitles flow
-            if text is not None:
-                # if the text too long for a frame
-                text = text[:250]
-
-                frame_counter += 1
-                start_time = str(datetime.timedelta(seconds=timer)) + ",000"
-                end_time = (
-                    str(datetime.timedelta(seconds=timer + interval_size)) + ",000"
-                )
-                frame = f"{frame_counter}\n{start_time} -->  {end_time}\n{text}\n\n"
-                f.write(frame)
-            timer += interval_size
+    if interval_size is None:
+        cues = segments_to_cues(texts)
+    else:
+        cues = to_cues(enumerate(texts), interval_size)
+    with SrtWriter(subtitles_path) as writer:
+        for cue in cues:
+            writer.write(cue)
     if logging:
-        logging.info(f"{frame_counter} subtitles frames have been generated")
+        logging.info(f"{writer.frame_counter} subtitles frames have been generated")
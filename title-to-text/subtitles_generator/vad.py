@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def frame_statistics(chunks: np.ndarray, frame_samples: int):
+    # per-frame energy in dB and spectral flatness, shape (chunks, frames)
+    n_frames = chunks.shape[1] // frame_samples
+    frames = chunks[:, : n_frames * frame_samples].reshape(chunks.shape[0], n_frames, frame_samples)
+
+    energy_db = 10 * np.log10(np.mean(frames**2, axis=-1) + 1e-10)
+
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_samples), axis=-1)) ** 2 + 1e-10
+    flatness = np.exp(np.mean(np.log(power), axis=-1)) / np.mean(power, axis=-1)
+    return energy_db, flatness
+
+
+def speech_chunks(
+    chunks: np.ndarray,
+    sampling_rate: int = 16000,
+    frame_ms: int = 25,
+    min_energy_db: float = -50,
+    energy_margin_db: float = 10,
+    noise_percentile: float = 10,
+    max_flatness: float = 0.5,
+    min_speech_ratio: float = 0.1,
+    block_size: int = 256,
+) -> np.ndarray:
+    # Marks every chunk (row of `chunks`) that contains speech. A frame is
+    # speech when it is louder than both an absolute floor and the file's
+    # noise floor plus a margin, and its spectrum is not noise-like (flat).
+    # A chunk is kept when enough of its frames are speech.
+    frame_samples = int(sampling_rate * frame_ms / 1000)
+
+    energy_db = np.empty((chunks.shape[0], chunks.shape[1] // frame_samples), dtype=np.float32)
+    flatness = np.empty_like(energy_db)
+    # blocks keep the FFT buffers small on long inputs
+    for i in range(0, chunks.shape[0], block_size):
+        energy_db[i : i + block_size], flatness[i : i + block_size] = frame_statistics(
+            chunks[i : i + block_size], frame_samples
+        )
+
+    noise_floor_db = np.percentile(energy_db, noise_percentile)
+    threshold_db = max(min_energy_db, noise_floor_db + energy_margin_db)
+
+    speech_frames = (energy_db > threshold_db) & (flatness < max_flatness)
+    return speech_frames.mean(axis=1) >= min_speech_ratio
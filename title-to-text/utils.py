@@ -1,21 +1,31 @@
+import io
 import os
-import cv2
 import wave
 import uuid
-import urllib
-import pyaudio
 import logging
 import threading
 import subprocess
+import urllib.parse
 import numpy as np
 from pathlib import Path
-from pytube import YouTube
-from langdetect import detect
-import speech_recognition as sr
 from hydra import compose, initialize
-from moviepy.editor import VideoFileClip
-from subtitles_generator.core import Model
-from subtitles_generator.utils import create_srt, extract_audio
+from omegaconf import OmegaConf
+from subtitles_generator.audio import decode_audio
+from subtitles_generator.batching import BatchScheduler
+from subtitles_generator.cache import TranscriptCache
+from subtitles_generator.core import PRECISIONS, AssistedDecodingStats
+from subtitles_generator.decoding import DecodingStats
+from subtitles_generator.metrics import LANGUAGE_DETECTION_SECONDS
+from subtitles_generator.parallel import ParallelTranscriber
+from subtitles_generator.pipeline import PipelineStats
+from subtitles_generator.registry import ModelRegistry
+from subtitles_generator.transcript import (
+    new_transcript,
+    record_chunks,
+    record_segments,
+    transcript_path,
+)
+from subtitles_generator.utils import SrtWriter, segments_to_cues, to_cues
 
 # Configure logging
 logging.basicConfig(
@@ -26,7 +36,45 @@ logging.basicConfig(
 
 VIDEO_SAVE_DIRECTORY = "./video"
 
+_model_registry = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry(cfg):
+    # the registry is shared by every caller in the process (API and Streamlit)
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            max_memory_gb = cfg.registry.max_memory_gb
+            _model_registry = ModelRegistry(
+                max_memory_bytes=int(max_memory_gb * 1024**3)
+                if max_memory_gb is not None
+                else None
+            )
+    return _model_registry
+
+
+_batch_scheduler = None
+_transcript_cache = None
+
+
+def get_batch_scheduler(cfg):
+    # chunks from concurrent jobs on the same model share generate calls
+    global _batch_scheduler
+    if not cfg.batching.enabled:
+        return None
+    with _model_registry_lock:
+        if _batch_scheduler is None:
+            _batch_scheduler = BatchScheduler(
+                max_batch_size=cfg.batching.max_batch_size,
+                max_wait_ms=cfg.batching.max_wait_ms,
+            )
+    return _batch_scheduler
+
+
 def download_video(video_url):
+    from pytube import YouTube
+
     try:
         video = YouTube(video_url)
         video_stream = video.streams.get_highest_resolution()
@@ -40,9 +88,58 @@ def download_video(video_url):
         return None
 
 
-def identify_language_from_audio(audio_file):
+def audio_to_wav_buffer(speech_array, sampling_rate=16000):
+    # in-memory 16-bit WAV for consumers that only accept files
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sampling_rate)
+        wf.writeframes((np.clip(speech_array, -1, 1) * 32767).astype(np.int16).tobytes())
+    buffer.seek(0)
+    return buffer
+
+
+def detect_language_probabilities(audio_file, sampling_rate=16000, model_size=None, precision=None):
+    # Whisper language identification on the first 30 s, using the cached
+    # model at the precision the transcription runs at
+    cfg = load_config()
+    model_size = model_size or cfg.language_detection.model_size
+    model = get_model(cfg, model_size, precision)
+    return model.detect_language(audio_file, cfg.supported_languages, sampling_rate)
+
+
+def identify_language_from_audio(audio_file, sampling_rate=16000, model_size=None, precision=None):
+    cfg = load_config()
+    if cfg.language_detection.method == "google":
+        with LANGUAGE_DETECTION_SECONDS.time(method="google"):
+            return identify_language_with_google(audio_file, sampling_rate)
+
+    try:
+        with LANGUAGE_DETECTION_SECONDS.time(method="whisper"):
+            probabilities = detect_language_probabilities(audio_file, sampling_rate, model_size, precision)
+    except Exception as e:
+        logging.info(f"Error: {e}")
+        return "Unknown"
+
+    language, probability = max(probabilities.items(), key=lambda item: item[1])
+    logging.info(f"Detected Language : {language} ({probability:.2f})")
+    if probability < cfg.language_detection.min_probability:
+        return "Unknown"
+    return language
+
+
+def identify_language_with_google(audio_file, sampling_rate=16000):
+    import speech_recognition as sr
+    from langdetect import detect
+
     recognizer = sr.Recognizer()
 
+    # Accept decoded samples as well as a path to any media file
+    if not isinstance(audio_file, np.ndarray):
+        audio_file = decode_audio(audio_file, sampling_rate)
+    audio_file = audio_to_wav_buffer(audio_file, sampling_rate)
+
     # Load audio file
     with sr.AudioFile(audio_file) as source:
         audio_data = recognizer.record(source)
@@ -73,6 +170,7 @@ def identify_language_from_audio(audio_file):
 
 
 def extract_audio_from_video(video_file):
+    from moviepy.editor import VideoFileClip
 
     video_file = str(video_file)
 
@@ -101,19 +199,139 @@ def is_url(input_file):
         return False
 
 
-def generate_subtitles_from_file(
-    model_size: str, input_file: str, output_file_path: str = None, lang: str = None
-):
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_transcript_cache(cfg):
+    global _transcript_cache
+    if not cfg.cache.enabled:
+        return None
+    with _model_registry_lock:
+        if _transcript_cache is None:
+            _transcript_cache = TranscriptCache(
+                cfg.cache.directory, max_bytes=int(cfg.cache.max_size_mb * 1024**2)
+            )
+    return _transcript_cache
+
+
+_parallel_transcribers = {}
+
+
+def get_parallel_transcriber(cfg, model_name, n_workers, precision):
+    # worker processes keep their models loaded between jobs
+    key = (model_name, n_workers, precision)
+    with _model_registry_lock:
+        if key not in _parallel_transcribers:
+            _parallel_transcribers[key] = ParallelTranscriber(
+                model_name,
+                n_workers,
+                precision=precision,
+                threads_per_worker=cfg.parallel.threads_per_worker,
+                pin_cores=cfg.parallel.pin_cores,
+            )
+    return _parallel_transcribers[key]
+
+
+def get_vad_options(cfg):
+    if not cfg.vad.enabled:
+        return None
+    return {key: value for key, value in cfg.vad.items() if key != "enabled"}
+
+
+def get_pipeline_options(cfg):
+    return dict(cfg.pipeline)
+
+
+def get_decoding_options(cfg):
+    decoding = cfg.decoding
+    if decoding.profile not in decoding.profiles:
+        raise ValueError(
+            f"Decoding profile {decoding.profile} is not defined. Defined profiles are {list(decoding.profiles)}"
+        )
+    return {
+        **decoding.profiles[decoding.profile],
+        "tokens_per_second": decoding.tokens_per_second,
+        "min_new_tokens": decoding.min_new_tokens,
+        "max_ngram": decoding.max_ngram,
+        "max_repeats": decoding.max_repeats,
+    }
+
+
+def load_config():
+    # Composed once per process and shared read-only; Hydra's global state
+    # is not thread safe and jobs run on worker threads
+    global _config
+    with _config_lock:
+        if _config is None:
+            with initialize(version_base=None, config_path="subtitles_generator/conf"):
+                _config = compose(config_name="config")
+            OmegaConf.set_readonly(_config, True)
+    return _config
+
+
+def get_model(cfg, model_size, precision=None):
+    # registry lookup with the configured precision and optimization mode
+    return get_model_registry(cfg).get(
+        cfg.model_names[model_size],
+        precision=precision or cfg.registry.precision,
+        optimize=cfg.optimization.enabled,
+    )
+
 
-    with initialize(version_base=None, config_path="subtitles_generator/conf"):
-        cfg = compose(config_name="config")
+def preload_models(cfg):
+    # Loads the configured models into the registry and runs short generate
+    # calls on each, so the first request does not pay for weight loading,
+    # first-call allocations or compilation. Optimized models are warmed up
+    # for every batch size the server runs.
+    sampling_rate = cfg.processing.sampling_rate
+    chunk_size = cfg.processing.chunk_size
+    batch_sizes = [1]
+    if cfg.optimization.enabled:
+        batch_sizes = sorted({cfg.processing.batch_size, cfg.batching.max_batch_size})
+    for model_size in cfg.serving.preload_models:
+        model = get_model(cfg, model_size)
+        if cfg.serving.warmup:
+            model.warmup(batch_sizes, chunk_size, sampling_rate)
+        logging.info(f"Preloaded model {model_size}")
+
+
+def stream_subtitles_from_file(
+    model_size: str,
+    input_file: str,
+    output_file_path: str = None,
+    lang: str = None,
+    progress_callback=None,
+    audio: np.ndarray = None,
+    workers: int = None,
+    precision: str = None,
+    assistant_stats: AssistedDecodingStats = None,
+    decoding_stats: DecodingStats = None,
+    pipeline_stats: PipelineStats = None,
+):
+    # Validates the request and returns the .srt path together with a
+    # generator of cues. The .srt file is written cue by cue while the
+    # generator is consumed; once it is complete the full transcript is
+    # stored next to it (see subtitles_generator.transcript). `audio` can
+    # carry samples the caller already decoded from `input_file`; otherwise
+    # the file is streamed through the decoder window by window. `workers`
+    # overrides parallel.workers from the config to shard the transcription
+    # over several processes, `precision` overrides registry.precision
+    # (fp32, bf16 or int8). With assisted decoding enabled, acceptance
+    # counts are added to `assistant_stats`; early stops and saved tokens go
+    # into `decoding_stats` and the busy and idle time of the decode,
+    # feature and generate stages into `pipeline_stats`.
+
+    cfg = load_config()
     input_file_path = Path(input_file)
 
     if not input_file_path.is_file():
         raise FileNotFoundError(f"Input file {input_file} does not exist")
 
-    output_file_path = Path("output") / (Path(input_file).stem + ".srt")
-    # output_file_path = Path("output") / (Path(input_file))
+    if output_file_path:
+        output_file_path = Path(output_file_path)
+    else:
+        output_file_path = Path("output") / (Path(input_file).stem + ".srt")
 
     if lang not in cfg.supported_languages:
         raise ValueError(
@@ -125,36 +343,166 @@ def generate_subtitles_from_file(
             f"Model size {model_size} is not supported. Supported model sizes are {list(cfg.model_names.keys())}"
         )
 
-    # Extract audio if input is a video
-    if input_file_path.suffix in cfg.supported_media_formats.video:
-        logging.info("Extracting audio ...")
-        input_file_path = extract_audio(input_file_path)
-
-    # Initialize model
-    model = Model(cfg.model_names[model_size], lang)
+    precision = precision or cfg.registry.precision
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Precision {precision} is not supported. Supported precisions are {list(PRECISIONS)}"
+        )
 
-    # Transcribe audio and generate subtitles
-    logging.info("Generating subtitles ...")
-    predicted_texts = model.transcribe(
-        audio_path=input_file_path,
-        sampling_rate=cfg.processing.sampling_rate,
-        chunk_size=cfg.processing.chunk_size,
-    )
+    def cues():
+        nonlocal assistant_stats
+        source = input_file_path if audio is None else audio
+        settings = dict(
+            model_name=cfg.model_names[model_size],
+            precision=precision,
+            lang=lang,
+            sampling_rate=cfg.processing.sampling_rate,
+            chunk_size=cfg.processing.chunk_size,
+            vad=get_vad_options(cfg),
+            decoding=get_decoding_options(cfg),
+            long_form=dict(cfg.long_form) if cfg.long_form.enabled else None,
+        )
 
-    # Write subtitles to output file
-    logging.info(f"Writing subtitles into {output_file_path} ...")
-    create_srt(output_file_path, predicted_texts, cfg.processing.chunk_size)
+        # Identical audio with identical settings was transcribed before
+        cache = get_transcript_cache(cfg)
+        if cache is not None:
+            # keyed by the media file even when its samples are already
+            # decoded, so a path and an upload of it share the entry
+            cache_key = cache.make_key(input_file_path, **settings)
+            cached_transcript = cache.get(cache_key)
+            if cached_transcript is not None:
+                logging.info(f"Transcript cache hit, writing {output_file_path} ...")
+                cached_transcript.save(transcript_path(output_file_path))
+                segments = ((s.start, s.end, s.text) for s in cached_transcript.segments)
+                with SrtWriter(output_file_path) as writer:
+                    for cue in segments_to_cues(segments):
+                        writer.write(cue)
+                        yield cue
+                return
+
+        # every segment is kept in full in the transcript, so other layouts
+        # and formats can be rendered later without the model
+        transcript = new_transcript(input_file=str(input_file_path), **settings)
+
+        # Transcribe audio and write subtitles as batches are decoded
+        logging.info(f"Generating subtitles into {output_file_path} ...")
+        transcribe_options = dict(
+            audio=source,
+            sampling_rate=cfg.processing.sampling_rate,
+            chunk_size=cfg.processing.chunk_size,
+            lang=lang,
+            batch_size=cfg.processing.batch_size,
+            progress_callback=progress_callback,
+            vad_options=get_vad_options(cfg),
+            decoding_options=get_decoding_options(cfg),
+            pipeline_options=get_pipeline_options(cfg),
+        )
+        n_workers = workers or cfg.parallel.workers
+        if cfg.long_form.enabled:
+            # 30 s windows timed by Whisper itself; segments carry their own times
+            model = get_model(cfg, model_size, precision)
+            predicted_texts = model.transcribe_long_form(
+                source,
+                sampling_rate=cfg.processing.sampling_rate,
+                lang=lang,
+                batch_size=cfg.long_form.batch_size,
+                progress_callback=progress_callback,
+                vad_options=get_vad_options(cfg),
+                overlap_seconds=cfg.long_form.overlap_seconds,
+                decoding_options=get_decoding_options(cfg),
+                decoding_stats=decoding_stats,
+            )
+            predicted_cues = segments_to_cues(record_segments(predicted_texts, transcript))
+        elif n_workers > 1:
+            # shard the chunks over worker processes with their own models
+            transcriber = get_parallel_transcriber(
+                cfg, cfg.model_names[model_size], n_workers, precision
+            )
+            predicted_texts = transcriber.transcribe_stream(**transcribe_options)
+            predicted_cues = to_cues(
+                record_chunks(predicted_texts, transcript, cfg.processing.chunk_size),
+                cfg.processing.chunk_size,
+            )
+        else:
+            # Reuse an already loaded model when possible
+            model = get_model(cfg, model_size, precision)
+            assistant = None
+            if cfg.assisted.enabled:
+                # the draft model shares the registry with regular requests
+                assistant = get_model(cfg, cfg.assisted.draft_model_size, precision)
+                if assistant_stats is None:
+                    assistant_stats = AssistedDecodingStats()
+            predicted_texts = model.transcribe_stream(
+                scheduler=get_batch_scheduler(cfg),
+                assistant=assistant,
+                assistant_stats=assistant_stats,
+                decoding_stats=decoding_stats,
+                pipeline_stats=pipeline_stats,
+                **transcribe_options,
+            )
+            predicted_cues = to_cues(
+                record_chunks(predicted_texts, transcript, cfg.processing.chunk_size),
+                cfg.processing.chunk_size,
+            )
+        try:
+            with SrtWriter(output_file_path) as writer:
+                for cue in predicted_cues:
+                    writer.write(cue)
+                    yield cue
+            logging.info(f"{writer.frame_counter} subtitles frames have been generated")
+            if assistant_stats is not None and assistant_stats.chunks:
+                logging.info(f"Assisted decoding: {assistant_stats.as_dict()}")
+            if decoding_stats is not None and decoding_stats.sequences:
+                logging.info(f"Decoding: {decoding_stats.as_dict()}")
+            if pipeline_stats is not None and pipeline_stats.stages:
+                logging.info(f"Pipeline: {pipeline_stats.as_dict()}")
+        finally:
+            predicted_texts.close()
+
+        # only complete transcriptions are stored and cached
+        transcript.save(transcript_path(output_file_path))
+        if cache is not None:
+            cache.put(cache_key, transcript, input_file=str(input_file_path))
+
+    return output_file_path, cues()
 
-    # Remove temporary audio file if extracted
 
-    if os.path.exists(input_file_path):
-        os.remove(input_file_path)
-        # ----> os.remove(input_file)
+def generate_subtitles_from_file(
+    model_size: str,
+    input_file: str,
+    output_file_path: str = None,
+    lang: str = None,
+    progress_callback=None,
+    audio: np.ndarray = None,
+    workers: int = None,
+    precision: str = None,
+    assistant_stats: AssistedDecodingStats = None,
+    decoding_stats: DecodingStats = None,
+    pipeline_stats: PipelineStats = None,
+):
+    output_file_path, cues = stream_subtitles_from_file(
+        model_size,
+        input_file,
+        output_file_path,
+        lang,
+        progress_callback,
+        audio,
+        workers,
+        precision,
+        assistant_stats,
+        decoding_stats,
+        pipeline_stats,
+    )
+    for _ in cues:
+        pass
 
     return output_file_path
 
 
 def record_video_and_audio():
+    import cv2
+    import pyaudio
+
     # Parameters for audio recording
     FORMAT = pyaudio.paInt16
     CHANNELS = 1  # Change to 1 channel (mono)